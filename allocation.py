@@ -0,0 +1,88 @@
+"""Batch trip planning for NavGo: assign cars and check equipment for many trips in one pass."""
+from availability import BookingIndex, cargo_limit, equipment_usage, fits_car, parse_equip_str
+
+
+class TripPlan:
+    """Existing bookings plus the trips placed so far in one batch.
+
+    book_idx / equip_table describe the stored bookings and are only read; trips placed
+    here live in their own small index, so checking a batch never touches the shared ones.
+    """
+
+    def __init__(self, book_idx, equip_table, stock_totals, company_cars):
+        self.book_idx = book_idx
+        self.equip_table = equip_table
+        self.stock_totals = stock_totals
+        self.company_cars = set(company_cars)
+        self._placed = BookingIndex()
+        self._equip = {}
+
+    def used(self, start, end):
+        used = equipment_usage(self.equip_table, self.book_idx.overlapping(start, end)).to_dict()
+        for key in self._placed.overlapping(start, end):
+            for item, qty in self._equip[key].items():
+                used[item] = used.get(item, 0) + qty
+        return used
+
+    def busy_cars(self, start, end):
+        return self.book_idx.busy_cars(start, end) | self._placed.busy_cars(start, end)
+
+    def stock_conflicts(self, equip, start, end):
+        used, reasons = self.used(start, end), []
+        for item, qty in equip.items():
+            if item in self.stock_totals and used.get(item, 0) + qty > self.stock_totals[item]:
+                reasons.append(f"{item} เหลือไม่พอ (ว่าง {max(0, self.stock_totals[item] - used.get(item, 0))})")
+        return reasons
+
+    def conflicts(self, car, equip, start, end):
+        reasons = [f"รถ {car} ไม่ว่างช่วงนี้"] if car in self.company_cars and car in self.busy_cars(start, end) else []
+        return reasons + self.stock_conflicts(equip, start, end)
+
+    def place(self, key, car, equip, start, end):
+        self._placed.add(key, car, start, end)
+        self._equip[key] = equip
+
+
+def allocate_trips(trips, car_specs, plan, volumes):
+    """Assign a car to every trip of `trips` (People, Equipment, Start_Time, End_Time) at once.
+
+    Trips are placed in start order, larger groups and loads first on ties, each on the free
+    company car with the least room to spare so bigger cars stay open for bigger trips. A
+    private car is only used when no company car fits; trips with 0 people need no car.
+    Returns a copy of `trips` with Car (None if unplaced) and Problem columns.
+    """
+    company = {c: s for c, s in car_specs.items() if s['type'] == 'company'}
+    private = next((c for c, s in car_specs.items() if s['type'] == 'private'), None)
+    no_car = next((c for c, s in car_specs.items() if s['type'] == 'no_car'), None)
+
+    out = trips.copy()
+    out['Car'], out['Problem'] = None, ""
+    equips = {k: parse_equip_str(str(v)) for k, v in trips['Equipment'].items()}
+    loads = {k: sum(volumes.get(item, 0) * qty for item, qty in equip.items()) for k, equip in equips.items()}
+    order = sorted(trips.index, key=lambda k: (trips.at[k, 'Start_Time'], -int(trips.at[k, 'People']), -loads[k]))
+
+    for k in order:
+        s, e, ppl = trips.at[k, 'Start_Time'], trips.at[k, 'End_Time'], int(trips.at[k, 'People'])
+        if not s < e:
+            out.at[k, 'Problem'] = "เวลาผิดพลาด"
+            continue
+        problems = [f"ไม่พบอุปกรณ์ {item}" for item in equips[k] if item not in plan.stock_totals]
+        problems += plan.stock_conflicts(equips[k], s, e)
+        if problems:
+            out.at[k, 'Problem'] = ", ".join(problems)
+            continue
+        if ppl == 0 and no_car:
+            car = no_car
+        else:
+            busy = plan.busy_cars(s, e)
+            free = [c for c, spec in company.items() if c not in busy and fits_car(spec, ppl, loads[k])]
+            if free:
+                car = min(free, key=lambda c: (cargo_limit(company[c], ppl) - loads[k], company[c]['max_seats'] - ppl))
+            elif private and fits_car(car_specs[private], ppl, loads[k]):
+                car = private
+            else:
+                out.at[k, 'Problem'] = "ไม่มีรถที่รองรับได้"
+                continue
+        out.at[k, 'Car'] = car
+        plan.place(k, car, equips[k], s, e)
+    return out
@@ -0,0 +1,262 @@
+"""Read-only HTTP/JSON availability service for NavGo (front desk screens, other tools).
+
+    python api.py                                  # http://0.0.0.0:8502, refresh every 30 s
+    python api.py --port 9000 --refresh 60
+
+    GET /availability?start=2030-01-01T08:00&end=2030-01-01T12:00[&items=GPS x2, Drone x1]
+    GET /now        who has which car / equipment right now (the admin Monitor)
+    GET /due        due later today, overdue with equipment, equipment out now
+    GET /health     snapshot revision and age
+
+Reads the same .streamlit/secrets.toml as the app. All answers come from one in-memory
+snapshot that a background thread reloads only when the bookings revision or the stock /
+cars tables change, so pollers never touch the storage backend. Every response carries an ETag; a request
+with a matching If-None-Match gets an empty 304.
+"""
+import argparse
+import copy
+import hashlib
+import json
+import threading
+import time
+import tomllib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from availability import BookingIndex, build_equipment_table, end_time_view, parse_equip_str, stock_status
+from reminders import due_report, get_thai_time, has_equipment
+from storage import car_specs, empty_bookings, open_backend
+
+
+def reference_key(df_stock, df_cars):
+    # Content hash of stock + cars: saving them does not bump the bookings revision
+    h = hashlib.sha1()
+    for df in (df_stock, df_cars):
+        h.update(",".join(map(str, df.columns)).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:12]
+
+
+class Snapshot:
+    """Bookings at one revision plus stock and cars, with the lookups built once.
+
+    `version` (revision + stock/cars hash) keys the rendered responses, so an edit to
+    any of the three yields new bodies and ETags.
+    """
+
+    def __init__(self, revision, df_book, df_stock, df_cars):
+        self.revision = revision
+        self.loaded_at = time.time()
+        self.df_book = df_book
+        self.book_idx = BookingIndex.from_frame(df_book)
+        self.equip_table = build_equipment_table(df_book)
+        self.end_view = end_time_view(df_book)
+        self._set_reference(df_stock, df_cars)
+
+    def _set_reference(self, df_stock, df_cars):
+        self.df_stock = df_stock
+        self.df_cars = df_cars
+        self.car_specs = car_specs(df_cars)
+        self.reference = reference_key(df_stock, df_cars)
+        self.version = f"{self.revision}:{self.reference}"
+
+    def with_reference(self, df_stock, df_cars):
+        # Stock or cars changed but the bookings did not: keep the booking lookups
+        snap = copy.copy(self)
+        snap.loaded_at = time.time()
+        snap._set_reference(df_stock, df_cars)
+        return snap
+
+    @classmethod
+    def load(cls, backend):
+        rev = backend.revision()
+        df_book = backend.read_bookings()
+        return cls(rev, df_book if not df_book.empty else empty_bookings(), backend.read_stock(), backend.read_cars())
+
+
+def _time(v):
+    return v.strftime('%Y-%m-%dT%H:%M:%S') if pd.notna(v) else None
+
+
+def booking_json(row):
+    return {"BookingID": row['BookingID'], "User": row['User'], "Task": row['Task'], "Location": row['Location'],
+            "Car": row['Car'], "Equipment": parse_equip_str(str(row['Equipment'])),
+            "Start_Time": _time(row['Start_Time']), "End_Time": _time(row['End_Time'])}
+
+
+def availability(snap, start, end, items=None):
+    """Company cars free for the whole [start, end) and per-item stock left, as in the booking tab."""
+    keys = snap.book_idx.active_at(start) if start == end else snap.book_idx.overlapping(start, end)
+    busy = {str(snap.df_book.at[k, 'Car']) for k in keys}
+    status = stock_status(snap.df_stock, snap.equip_table, keys)
+    out = {
+        "start": _time(start), "end": _time(end),
+        "cars": [{"name": c, "type": s['type'], "max_seats": s['max_seats'], "free": s['type'] != 'company' or c not in busy}
+                 for c, s in snap.car_specs.items()],
+        "items": {k: {"total": int(r.Total), "used": int(r.Used), "available": int(max(0, r.Available))} for k, r in status.iterrows()},
+    }
+    if items is not None:
+        wanted = parse_equip_str(items)
+        short = {k: q for k, q in wanted.items() if k not in out["items"] or out["items"][k]["available"] < q}
+        out["requested"], out["ok"], out["short"] = wanted, not short, short
+    return out
+
+
+def who_has_what(snap, now):
+    active = snap.df_book.loc[snap.book_idx.active_at(now)]
+    active = active[has_equipment(active)].sort_values('End_Time')
+    return {"now": _time(now), "bookings": [booking_json(r) for _, r in active.iterrows()]}
+
+
+def due(snap, now, overdue_hours=24):
+    due_today, overdue, out_now = due_report(snap.end_view, now, overdue_hours)
+    return {"now": _time(now), **{name: [booking_json(r) for _, r in part.iterrows()]
+                                  for name, part in (("due_today", due_today), ("overdue", overdue), ("out_now", out_now))}}
+
+
+class SnapshotCache:
+    """Current Snapshot plus memoized rendered responses.
+
+    refresh() checks the bookings revision and re-reads the small stock and cars tables;
+    bookings are only reloaded when the revision moved.
+    Rendered bodies are keyed by snapshot version, path and query, and the minute for
+    "now"-relative answers, so repeated polls reuse one JSON body and its ETag.
+    """
+
+    def __init__(self, backend, interval=30, max_responses=256):
+        self.backend = backend
+        self.interval = interval
+        self.max_responses = max_responses
+        self.snapshot = Snapshot.load(backend)
+        self.error = None
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            snap, rev = self.snapshot, self.backend.revision()
+            df_stock, df_cars = self.backend.read_stock(), self.backend.read_cars()
+            if rev != snap.revision:
+                df_book = self.backend.read_bookings()
+                self.snapshot = Snapshot(rev, df_book if not df_book.empty else empty_bookings(), df_stock, df_cars)
+            elif reference_key(df_stock, df_cars) != snap.reference:
+                self.snapshot = snap.with_reference(df_stock, df_cars)
+            self.error = None
+        except Exception as e:
+            # Keep serving the last good snapshot; /health shows what went wrong
+            self.error = f"{type(e).__name__}: {e}"
+
+    def start(self):
+        def loop():
+            while True:
+                time.sleep(self.interval)
+                self.refresh()
+        threading.Thread(target=loop, name="navgo-api-refresh", daemon=True).start()
+        return self
+
+    def response(self, key, render):
+        """(etag, body bytes) for `key`, rendering with render(snapshot) at most once per key."""
+        snap = self.snapshot
+        key = (snap.version,) + key
+        with self._lock:
+            hit = self._responses.get(key)
+            if hit is not None:
+                self._responses.move_to_end(key)
+                return hit
+        body = json.dumps(render(snap), ensure_ascii=False).encode("utf-8")
+        hit = ('"' + hashlib.sha1(body).hexdigest()[:20] + '"', body)
+        with self._lock:
+            self._responses[key] = hit
+            while len(self._responses) > self.max_responses: self._responses.popitem(last=False)
+        return hit
+
+
+def _param_time(params, name, default):
+    if name not in params: return default
+    t = pd.Timestamp(params[name][0])
+    if pd.isna(t): raise ValueError(f"bad {name}")
+    # Naive times are Thai local time, like the sheets
+    return t.tz_convert('Asia/Bangkok').tz_localize(None) if t.tzinfo else t
+
+
+def route(path, params):
+    """(key, render) for a GET, or None for an unknown path. Raises ValueError for bad parameters."""
+    now = pd.Timestamp(get_thai_time()).floor('min')
+    if path == "/availability":
+        start = _param_time(params, "start", now)
+        end = _param_time(params, "end", start)
+        if end < start: raise ValueError("end before start")
+        items = params["items"][0] if "items" in params else None
+        minute = now if "start" not in params else None
+        return ("availability", start, end, items, minute), lambda s: availability(s, start, end, items)
+    if path == "/now":
+        return ("now", now), lambda s: who_has_what(s, now)
+    if path == "/due":
+        hours = int(params.get("overdue_hours", ["24"])[0])
+        return ("due", now, hours), lambda s: due(s, now, hours)
+    return None
+
+
+def make_handler(cache):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body=b"", etag=None):
+            self.send_response(status)
+            if etag: self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            if status != 304:
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if status != 304: self.wfile.write(body)
+
+        def _error(self, status, msg):
+            self._send(status, json.dumps({"error": msg}).encode("utf-8"))
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            path, params = url.path.rstrip("/") or "/", parse_qs(url.query)
+            if path == "/health":
+                snap = cache.snapshot
+                body = {"revision": snap.revision, "bookings": len(snap.df_book), "age_seconds": round(time.time() - snap.loaded_at, 1),
+                        "error": cache.error}
+                return self._send(200, json.dumps(body).encode("utf-8"))
+            try:
+                found = route(path, params)
+            except ValueError as e:
+                return self._error(400, str(e))
+            if found is None: return self._error(404, "not found")
+            etag, body = cache.response(*found)
+            if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                return self._send(304, etag=etag)
+            self._send(200, body, etag)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NavGo read-only availability API")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--refresh", type=float, default=30, help="seconds between bookings revision checks")
+    args = parser.parse_args(argv)
+
+    with open(args.secrets, "rb") as f:
+        settings = tomllib.load(f)
+    cache = SnapshotCache(open_backend(settings), args.refresh).start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(cache))
+    print(f"NavGo API on http://{args.host}:{args.port} (revision {cache.snapshot.revision})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
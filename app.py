@@ -1,10 +1,20 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import time
-import requests
+import json
+import uuid
+from functools import wraps
+from allocation import TripPlan, allocate_trips
+from availability import (AvailabilityTimeline, BookingIndex, build_equipment_table, end_time_view, ending_between,
+                          fitting_cars, parse_equip_str)
+from notify import NotificationQueue, telegram_config
+from importer import IMPORT_COLUMNS, import_conflicts, normalize_rows, read_bookings_file, validate_bookings
+from model import BookingModel
+from perf import PerfRecorder
+from reminders import format_due_digest
+from rollups import RollupStore
+from storage import (BookingConflict, SheetsBackend, SQLiteBackend, apply_changes, authorize_client, car_specs, commit_booking,
+                     commit_bookings, empty_bookings, import_backend, open_backend, with_archive)
 
 # --- CONFIG & SETUP ---
 st.set_page_config(page_title="NavGo System V8 (Manage)", layout="wide", initial_sidebar_state="expanded")
@@ -12,133 +22,316 @@ st.set_page_config(page_title="NavGo System V8 (Manage)", layout="wide", initial
 def get_thai_time():
     return datetime.utcnow() + timedelta(hours=7)
 
+def get_setting(key, default=None):
+    try:
+        return st.secrets.get(key, default)
+    except Exception:
+        return default
+
+# Seconds a loaded snapshot of the sheets is shared between reruns/sessions
+CACHE_TTL = int(get_setting("cache_ttl_seconds", 60))
+# Completed bookings older than this many days are moved out of the hot sheet by the admin archive action
+ARCHIVE_AFTER_DAYS = int(get_setting("archive_after_days", 30))
+
+# --- PERFORMANCE INSTRUMENTATION ---
+@st.cache_resource(show_spinner=False)
+def get_perf():
+    # perf_buffer_size: events kept in memory; perf_log_path: optional JSON-lines log of every event
+    return PerfRecorder(int(get_setting("perf_buffer_size", 2000)), get_setting("perf_log_path"))
+
+def timed(op):
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with get_perf().measure(op):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+@st.cache_resource(show_spinner=False)
+@timed("get_client")
 def get_client():
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds_dict = dict(st.secrets["gcp_service_account"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
-    return client
+    return authorize_client(st.secrets["gcp_service_account"], on_response=get_perf().count_api_call)
+
+@st.cache_resource(show_spinner=False)
+def get_spreadsheet():
+    return get_client().open("CarBookingDB")
 
 # --- NOTIFY FUNCTION ---
+@st.cache_resource(show_spinner=False)
+def get_notifier():
+    # One background sender per process; the outbox file keeps unsent messages across restarts
+    token, chat_id = telegram_config(st.secrets)
+    return NotificationQueue(get_setting("notify_queue_path", "notify_queue.db"), token, chat_id).start()
+
+@timed("send_telegram_notify")
 def send_telegram_notify(msg):
     try:
-        # Check secrets location (support both root and nested)
-        if "telegram_token" in st.secrets:
-            token = st.secrets["telegram_token"]
-            chat_id = st.secrets["telegram_chat_id"]
-        elif "telegram" in st.secrets:
-            token = st.secrets["telegram"]["telegram_token"]
-            chat_id = st.secrets["telegram"]["telegram_chat_id"]
-        else:
-            return None
+        if telegram_config(st.secrets) is None: return None
+        get_notifier().enqueue(msg)
+    except Exception:
+        pass
 
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        payload = {'chat_id': chat_id, 'text': msg, 'parse_mode': 'HTML'}
-        requests.post(url, data=payload)
+def start_notifier():
+    # Start the sender with the app, not on the first new message: rows left in the outbox by a restart flush now
+    try:
+        if telegram_config(st.secrets) is not None: get_notifier()
     except Exception:
         pass
 
+def batch_summary_msg(title, rows):
+    # One message for a whole batch of new bookings
+    lines = "".join(f"👤 {r['User']} | 🚗 {r['Car']} | {r['Start_Time'].strftime('%d/%m %H:%M')} - {r['End_Time'].strftime('%d/%m %H:%M')}\n" for r in rows)
+    return f"📣 <b>{title} (NavGo)</b> {len(rows)} รายการ\n----------------------------\n{lines}"
+
 # --- LOAD DATA ---
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    # st.secrets: storage_backend = "sheets" (default) | "sqlite", sqlite_path = "navgo.db"
+    if get_setting("storage_backend", "sheets") == "sqlite":
+        return open_backend(st.secrets)
+    return open_backend(st.secrets, sh=get_spreadsheet())
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+@timed("read_sheets")
+def _load_frames():
+    store = get_backend()
+
+    # 1. Bookings. Read errors (quota 429, network, locked file) propagate: st.cache_data does not
+    # cache exceptions, so the next run retries instead of showing every car free for CACHE_TTL
+    revision = store.revision()
+    try:
+        df_book = store.read_bookings()
+    except KeyError:
+        # Bookings sheet without the expected header (e.g. blank first tab): nothing booked yet
+        df_book = empty_bookings()
+    df_book.attrs['version'] = uuid.uuid4().hex
+    df_book.attrs['revision'] = revision
+
+    # 2. Stock, Users & Cars (Standard Load)
+    df_stock = store.read_stock()
+    df_users = store.read_users()
+    df_cars = store.read_cars()
+
+    return df_book, df_stock, df_users, df_cars
+
+@timed("load_data")
 def load_data():
-    client = get_client()
     try:
-        sh = client.open("CarBookingDB")
+        store = get_backend()
     except:
-        st.error("❌ หาไฟล์ Google Sheets ไม่เจอ")
+        st.error("❌ หาไฟล์ Google Sheets ไม่เจอ" if get_setting("storage_backend", "sheets") != "sqlite" else "❌ เปิดฐานข้อมูล SQLite ไม่ได้")
         st.stop()
-    
-    existing_sheets = [ws.title for ws in sh.worksheets()]
-
-    # 1. Bookings
     try:
-        ws_book = sh.get_worksheet(0)
-        data_book = ws_book.get_all_records()
-        df_book = pd.DataFrame(data_book)
-        if df_book.empty and len(data_book) == 0:
-            df_book = pd.DataFrame(columns=["User", "Task", "Car", "People", "Equipment", "Location", "Start_Time", "End_Time"])
-        
-        if not df_book.empty:
-            df_book['Start_Time'] = pd.to_datetime(df_book['Start_Time'].astype(str), errors='coerce')
-            df_book['End_Time'] = pd.to_datetime(df_book['End_Time'].astype(str), errors='coerce')
-            df_book = df_book.dropna(subset=['Start_Time', 'End_Time'])
-            if 'Car' in df_book.columns: df_book['Car'] = df_book['Car'].astype(str).str.strip()
-            if 'Equipment' in df_book.columns: df_book['Equipment'] = df_book['Equipment'].astype(str)
-            # Create Display Column for Dropdown
-            df_book['Display'] = df_book.apply(lambda x: f"{x['User']} | {x['Car']} | {x['Start_Time'].strftime('%d/%m %H:%M')}", axis=1)
-    except:
-        df_book = pd.DataFrame(columns=["User", "Task", "Car", "People", "Equipment", "Location", "Start_Time", "End_Time"])
-
-    # 2. Stock & Users (Standard Load)
-    if "StockMaster" in existing_sheets:
-        ws_stock = sh.worksheet("StockMaster")
-        df_stock = pd.DataFrame(ws_stock.get_all_records())
-    else:
-        ws_stock = sh.add_worksheet("StockMaster", 100, 5)
-        ws_stock.append_row(["ItemName", "TotalQty", "VolumeScore", "Description"])
-        df_stock = pd.DataFrame(columns=["ItemName", "TotalQty", "VolumeScore", "Description"])
-
-    if "Users" in existing_sheets:
-        ws_users = sh.worksheet("Users")
-        df_users = pd.DataFrame(ws_users.get_all_records())
-    else:
-        ws_users = sh.add_worksheet("Users", 100, 2)
-        ws_users.append_row(["Name", "Department"])
-        ws_users.append_row(["Admin", "IT"])
-        df_users = pd.DataFrame([{"Name": "Admin", "Department": "IT"}])
-
-    return df_book, df_stock, df_users, sh
+        df_book, df_stock, df_users, df_cars = _current_frames()
+    except Exception as e:
+        st.error(f"❌ โหลดข้อมูลไม่สำเร็จ กรุณากดโหลดใหม่อีกครั้ง ({type(e).__name__}: {e})")
+        st.button("🔄 ลองใหม่")
+        st.stop()
+    return df_book, df_stock, df_users, df_cars, store
+
+@st.cache_resource(show_spinner=False)
+def _latest():
+    # 'snap': (frames, prebuilt lookups) this process derived from its own last commit
+    return {}
+
+def _current_frames():
+    # The derived snapshot wins until a storage read (every CACHE_TTL) reaches its revision
+    frames = _load_frames()
+    latest = _latest().get('snap')
+    if latest is not None:
+        rev = frames[0].attrs.get('revision')
+        if rev is None or latest[0][0].attrs['revision'] > rev: return latest[0]
+    return frames
+
+def _prebuilt(kind, version):
+    latest = _latest().get('snap')
+    return latest[1].get((kind, version)) if latest is not None else None
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_archive(start, end):
+    # Archived (cold) bookings are only read on demand, e.g. history views
+    return get_backend().read_archive(start, end)
+
+def invalidate_data():
+    _load_frames.clear()
+    load_archive.clear()
+    _latest().clear()
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _booking_index(version, _df_book):
+    idx = _prebuilt('index', version)
+    return idx if idx is not None else BookingIndex.from_frame(_df_book)
+
+def get_booking_index(df_book):
+    # Built once per loaded snapshot (or carried over from the last commit) and shared by every session; treat as read-only
+    return _booking_index(df_book.attrs.get('version'), df_book)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _equipment_table(version, _df_book):
+    table = _prebuilt('equip', version)
+    return table if table is not None else build_equipment_table(_df_book)
+
+def get_equipment_table(df_book):
+    return _equipment_table(df_book.attrs.get('version'), df_book)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _booking_model(version, _df_book, _df_stock, _df_cars):
+    return BookingModel(_df_book, _df_stock, _df_cars, get_equipment_table(_df_book))
+
+def get_booking_model(df_book, df_stock, df_cars):
+    # Typed arrays + lookups every page reads on each rerun; one per loaded snapshot (stock/cars reload with it)
+    return _booking_model(df_book.attrs.get('version'), df_book, df_stock, df_cars)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _booking_rows(version, _df_book):
+    return dict(zip(_df_book['BookingID'], _df_book.index))
+
+def get_booking_row(df_book, booking_id):
+    # BookingID -> df_book label via a per-snapshot hash map instead of scanning
+    label = _booking_rows(df_book.attrs.get('version'), df_book).get(booking_id)
+    return None if label is None else df_book.loc[label]
+
+def booking_labels(df):
+    # Vectorized dropdown labels; only ever called on the page being shown
+    return df['User'].astype(str) + " | " + df['Car'].astype(str) + " | " + df['Start_Time'].dt.strftime('%d/%m %H:%M')
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _end_time_view(version, _df_book):
+    return end_time_view(_df_book)
+
+def get_end_time_view(df_book):
+    return _end_time_view(df_book.attrs.get('version'), df_book)
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _availability_timeline(version, stock_totals, car_names, start, end, _df_book, _model):
+    keys = _model.labels[_model.overlapping(start, end)]
+    return AvailabilityTimeline.build(_df_book, get_equipment_table(_df_book), keys, dict(stock_totals), list(car_names), start, end)
+
+def get_availability_timeline(df_book, model, car_names, start, end):
+    # Cached per data version + stock totals, so exploring windows never goes back to Sheets. The window
+    # comes from the model's arrays: the slot tab renders on every booking-page run and must not build a BookingIndex
+    return _availability_timeline(df_book.attrs.get('version'), tuple(model.stock_totals.items()), tuple(car_names), start, end, df_book, model)
 
 # --- SAVE FUNCTIONS ---
-def save_booking(sh, df):
-    ws = sh.sheet1
-    # Remove Display column before saving
-    export_df = df.copy()
-    if 'Display' in export_df.columns: export_df = export_df.drop(columns=['Display'])
-    
-    export_df['Start_Time'] = export_df['Start_Time'].dt.strftime('%Y-%m-%d %H:%M:%S')
-    export_df['End_Time'] = export_df['End_Time'].dt.strftime('%Y-%m-%d %H:%M:%S')
-    ws.clear()
-    ws.update([export_df.columns.values.tolist()] + export_df.values.tolist())
+def get_stock_totals(df_stock):
+    return dict(zip(df_stock['ItemName'], df_stock['TotalQty'].astype(int).tolist())) if not df_stock.empty else {}
 
-def save_stock(sh, df):
-    ws = sh.worksheet("StockMaster")
-    ws.clear()
-    ws.update([df.columns.values.tolist()] + df.values.tolist())
+@st.cache_resource(show_spinner=False)
+def get_rollups():
+    # Daily utilization rollups in a local SQLite file (rebuilt from the bookings whenever they fall behind)
+    return RollupStore(get_setting("rollup_path", "rollups.db"))
 
-def save_users(sh, df):
-    ws = sh.worksheet("Users")
-    ws.clear()
-    ws.update([df.columns.values.tolist()] + df.values.tolist())
+@timed("update_rollups")
+def update_rollups(store, df_book, removed=None, added=None):
+    # Incremental only when our snapshot is exactly what the rollups reflect; otherwise the analytics page rebuilds them
+    try:
+        get_rollups().apply(df_book.attrs.get('revision'), store.revision(), removed, added)
+    except Exception:
+        pass
 
-# --- HELPERS ---
-def parse_equip_str(equip_str):
-    if not equip_str or equip_str in ["-", "nan", ""]: return {}
-    items = {}
-    for part in equip_str.split(','):
-        if ' x' in part:
-            try:
-                name, qty = part.strip().rsplit(' x', 1) 
-                items[name.strip()] = int(qty)
-            except: continue
-    return items
+@timed("publish_commit")
+def publish_commit(store, df_book, changes):
+    # After our own commit: when it is the only write since df_book was read (revision moved by one),
+    # derive the next snapshot in memory and update a copy of the cached index instead of re-reading
+    # storage and rebuilding. Anything else drops the caches.
+    rev = df_book.attrs.get('revision')
+    try:
+        ours = rev is not None and store.revision() == rev + 1
+    except Exception:
+        ours = False
+    if not ours: return invalidate_data()
+
+    applied = apply_changes(df_book, changes, _booking_rows(df_book.attrs.get('version'), df_book))
+    if applied is None: return invalidate_data()
+    df, drop, new = applied
+    df.attrs = {'version': uuid.uuid4().hex, 'revision': rev + 1}
+
+    idx = get_booking_index(df_book).copy()
+    for label in drop: idx.remove(label)
+    for label, r in new.iterrows(): idx.add(label, r['Car'], r['Start_Time'], r['End_Time'])
+    equip = get_equipment_table(df_book)
+    equip = pd.concat([equip[~equip.index.isin(drop)], build_equipment_table(new)])
+    version = df.attrs['version']
+    _latest()['snap'] = ((df,) + tuple(_current_frames()[1:]), {('index', version): idx, ('equip', version): equip})
+
+@timed("commit_booking_change")
+def commit_booking_change(store, op, row, df_book, df_stock, company_cars):
+    # Re-validates against the latest stored revision; raises BookingConflict instead of overwriting
+    try:
+        booking_id = commit_booking(store, op, row, set(company_cars), get_stock_totals(df_stock),
+                                    snapshot=df_book, book_idx=get_booking_index(df_book), equip_table=get_equipment_table(df_book))
+        old = get_booking_row(df_book, row.get('BookingID')) if op != 'add' else None
+        update_rollups(store, df_book, None if old is None else [old.to_dict()], None if op == 'cancel' else [row])
+    except BaseException:
+        invalidate_data()
+        raise
+    publish_commit(store, df_book, [(op, dict(row, BookingID=booking_id))])
+    return booking_id
+
+@timed("commit_booking_batch")
+def commit_booking_batch(store, rows, df_book, df_stock, company_cars, check=None):
+    # All rows in one write (or none), re-validated against each other and the latest revision
+    try:
+        ids = commit_bookings(store, rows, set(company_cars), get_stock_totals(df_stock), snapshot=df_book,
+                              book_idx=get_booking_index(df_book), equip_table=get_equipment_table(df_book), check=check)
+        update_rollups(store, df_book, added=rows)
+    except BaseException:
+        invalidate_data()
+        raise
+    publish_commit(store, df_book, [('add', dict(r, BookingID=i)) for r, i in zip(rows, ids)])
+    return ids
+
+@timed("save_booking")
+def save_booking(store, df, expected_rev):
+    # Full rewrite: maintenance/compaction only, day-to-day writes go through commit_booking_change.
+    # Rejected when anyone committed after `df` was loaded, so newer bookings are never erased
+    try:
+        if store.compact(df, expected_rev) is None:
+            raise BookingConflict(["มีการจองใหม่ระหว่างจัดระเบียบ กรุณาลองใหม่"])
+    finally:
+        invalidate_data()
+
+@timed("save_stock")
+def save_stock(store, df):
+    store.save_stock(df)
+    invalidate_data()
+
+@timed("save_users")
+def save_users(store, df):
+    store.save_users(df)
+    invalidate_data()
+
+@timed("save_cars")
+def save_cars(store, df):
+    store.save_cars(df)
+    invalidate_data()
 
-def get_stock_status(df_book, df_stock, query_time=None):
+# --- HELPERS ---
+def get_stock_status(model, query_time=None):
     if query_time is None: query_time = get_thai_time()
-    stock = {row['ItemName']: {"Total": int(row['TotalQty']), "Used": 0} for _, row in df_stock.iterrows()}
-    
-    if not df_book.empty:
-        active = df_book[(df_book['Start_Time'] <= query_time) & (df_book['End_Time'] >= query_time)]
-        for _, row in active.iterrows():
-            for k, v in parse_equip_str(row['Equipment']).items():
-                if k in stock: stock[k]['Used'] += v
-    
-    for k in stock: stock[k]['Available'] = stock[k]['Total'] - stock[k]['Used']
-    return pd.DataFrame(stock).T
+    return model.stock_status(model.active_at(query_time))
 
 # --- PAGE: ADMIN & INVENTORY ---
-def page_admin(df_book, df_stock, df_users, sh):
+@st.fragment(run_every=60)
+@timed("fragment_stock_metrics")
+def stock_metrics(model):
+    # Redrawn on its own every minute so returns show up without rerunning the admin page
+    status_df = get_stock_status(model)
+    if not status_df.empty:
+        status_df = status_df.sort_values(by="Available")
+        cols = st.columns(4)
+        for i, (item_name, row) in enumerate(status_df.iterrows()):
+            with cols[i % 4]:
+                delta_msg = f"-{int(row['Used'])} ใช้อยู่" if row['Used'] > 0 else "ครบ"
+                delta_color = "inverse" if row['Available'] == 0 else "normal"
+                st.metric(label=item_name, value=f"{int(row['Available'])} / {int(row['Total'])}", delta=delta_msg, delta_color=delta_color)
+
+@timed("page_admin")
+def page_admin(df_book, df_stock, df_users, df_cars, store):
     st.title("🛠️ Admin Dashboard")
     now = get_thai_time()
+    model = get_booking_model(df_book, df_stock, df_cars)
     
     # ------------------------------------------------
     # 1. DAILY REMINDER
@@ -150,28 +343,15 @@ def page_admin(df_book, df_stock, df_users, sh):
             if df_book.empty:
                 st.warning("ไม่มีข้อมูลการจอง")
             else:
-                today_str = now.strftime('%Y-%m-%d')
-                due_today = df_book[df_book['End_Time'].dt.strftime('%Y-%m-%d') == today_str]
+                day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+                due_today = ending_between(get_end_time_view(df_book), day_start, day_start + timedelta(days=1))
                 
                 if due_today.empty:
                     st.info("✅ วันนี้ไม่มีรายการครบกำหนดคืน")
                 else:
-                    count = len(due_today)
-                    msg_header = f"📢 <b>แจ้งเตือนรายการคืนวันนี้ ({now.strftime('%d/%m')})</b>\nมีทั้งหมด {count} รายการ\n----------------------------\n"
-                    msg_body = ""
-                    for _, row in due_today.iterrows():
-                        # --- เพิ่มสถานที่ในสรุปรายวัน ---
-                        msg_body += (
-                            f"👤 <b>{row['User']}</b>\n"
-                            f"📍 {row['Location']}\n" 
-                            f"🚗 {row['Car']}\n"
-                            f"📦 {row['Equipment']}\n"
-                            f"🔴 คืนเวลา: {row['End_Time'].strftime('%H:%M')}\n\n"
-                        )
-                    
-                    full_msg = msg_header + msg_body + "<i>รบกวนตรวจสอบและคืนของให้ตรงเวลาครับ</i>"
-                    send_telegram_notify(full_msg)
-                    st.success(f"ส่งแจ้งเตือน {count} รายการเรียบร้อย!")
+                    send_telegram_notify(format_due_digest(due_today, due_today.iloc[:0], now))
+                    st.success(f"ส่งแจ้งเตือน {len(due_today)} รายการเรียบร้อย!")
+        st.caption("💡 แจ้งเตือนอัตโนมัติ: รัน `python reminders.py` แยกจากแอป (ส่งสรุปตามเวลาที่ตั้งไว้ และไม่ส่งรายการซ้ำ)")
 
     st.divider()
 
@@ -181,7 +361,7 @@ def page_admin(df_book, df_stock, df_users, sh):
     st.write("### 🕵️‍♂️ Monitor")
     active = pd.DataFrame()
     if not df_book.empty:
-        active = df_book[(df_book['Start_Time'] <= now) & (df_book['End_Time'] >= now)]
+        active = df_book.iloc[model.active_at(now)]
 
     found = False
     if not active.empty:
@@ -197,21 +377,13 @@ def page_admin(df_book, df_stock, df_users, sh):
     # 3. STOCK & USER
     # ------------------------------------------------
     st.write("### 📊 สถานะคลังเครื่องมือ")
-    status_df = get_stock_status(df_book, df_stock, now)
-    if not status_df.empty:
-        status_df = status_df.sort_values(by="Available")
-        cols = st.columns(4)
-        for i, (item_name, row) in enumerate(status_df.iterrows()):
-            with cols[i % 4]:
-                delta_msg = f"-{int(row['Used'])} ใช้อยู่" if row['Used'] > 0 else "ครบ"
-                delta_color = "inverse" if row['Available'] == 0 else "normal"
-                st.metric(label=item_name, value=f"{int(row['Available'])} / {int(row['Total'])}", delta=delta_msg, delta_color=delta_color)
+    stock_metrics(model)
     
     with st.expander("📝 แก้ไข / เพิ่ม / ลบ อุปกรณ์ (คลิกที่นี่)"):
         st.caption("💡 วิธีใช้: แก้ไขตัวเลขในตารางได้เลย / เพิ่มแถวใหม่ด้านล่าง / ลบแถวโดยคลิกหน้าเลขแถวแล้วกด Delete")
         ed_stock = st.data_editor(df_stock, num_rows="dynamic", use_container_width=True, key="admin_stock")
         if st.button("💾 บันทึก Stock", type="primary"):
-            save_stock(sh, ed_stock)
+            save_stock(store, ed_stock)
             st.rerun()
 
     st.divider()
@@ -219,11 +391,232 @@ def page_admin(df_book, df_stock, df_users, sh):
     with st.expander("แก้ไขรายชื่อ"):
         ed_users = st.data_editor(df_users, num_rows="dynamic", use_container_width=True, key="admin_users")
         if st.button("บันทึกรายชื่อ"):
-            save_users(sh, ed_users)
+            save_users(store, ed_users)
+            st.rerun()
+
+    st.divider()
+    st.write("### 🚗 ข้อมูลรถ")
+    with st.expander("แก้ไขรถ (ที่นั่ง / พื้นที่บรรทุก)"):
+        st.caption("💡 CargoPerPerson = พื้นที่บรรทุกที่เสียไปต่อผู้โดยสาร 1 คน (ใส่ 0 สำหรับกระบะ) / Type: company, private, no_car")
+        ed_cars = st.data_editor(df_cars, num_rows="dynamic", use_container_width=True, key="admin_cars")
+        if st.button("บันทึกข้อมูลรถ"):
+            save_cars(store, ed_cars)
             st.rerun()
+
+    st.divider()
+    st.write("### 📑 นำเข้าการจองจากไฟล์ (CSV / Excel)")
+    with st.expander("อัปโหลดการจองหลายรายการ"):
+        st.caption(f"คอลัมน์: {', '.join(IMPORT_COLUMNS)} | เวลาเช่น `2030-01-31 08:00` | อุปกรณ์เช่น `GPS x2, Drone x1`")
+        upload = st.file_uploader("ไฟล์ CSV / XLSX", type=["csv", "xlsx"], key=f"bulk_import_file_{st.session_state.get('bulk_import_n', 0)}")
+        if upload is not None:
+            try:
+                rows = normalize_rows(read_bookings_file(upload))
+            except ImportError:
+                st.error("❌ อ่านไฟล์ Excel ต้องติดตั้ง openpyxl (หรือบันทึกเป็น CSV)")
+            except ValueError as e:
+                st.error(f"❌ อ่านไฟล์ไม่ได้: {e}")
+            else:
+                specs = car_specs(df_cars)
+                report = validate_bookings(rows, df_book, specs, df_stock, get_equipment_table(df_book))
+                ok = report[report['OK']]
+                i1, i2 = st.columns(2)
+                i1.metric("✅ ผ่าน", len(ok))
+                i2.metric("❌ มีปัญหา", len(report) - len(ok))
+                show = report.drop(columns='OK').set_axis(report.index + 1)
+                st.dataframe(show[['Errors'] + IMPORT_COLUMNS], use_container_width=True)
+                if st.button(f"📥 นำเข้า {len(ok)} รายการที่ผ่าน", type="primary", disabled=ok.empty):
+                    new_rows = [{"User": r['User'], "Task": r['Task'] or "-", "Car": r['Car'], "People": int(r['People']), "Equipment": r['Equipment'],
+                                 "Location": r['Location'], "Start_Time": r['Start_Time'].to_pydatetime(), "End_Time": r['End_Time'].to_pydatetime()}
+                                for _, r in ok.iterrows()]
+                    company_cars = [c for c, spec in specs.items() if spec['type'] == 'company']
+                    try:
+                        commit_booking_batch(store, new_rows, df_book, df_stock, company_cars, check=import_conflicts(specs, df_stock))
+                    except BookingConflict as e:
+                        st.error(f"❌ ข้อมูลเปลี่ยนระหว่างตรวจสอบ กรุณาลองใหม่ ({', '.join(e.reasons)})")
+                    else:
+                        send_telegram_notify(batch_summary_msg("นำเข้าการจอง", new_rows))
+                        # A fresh uploader key clears the imported file
+                        st.session_state.bulk_import_n = st.session_state.get('bulk_import_n', 0) + 1
+                        st.toast(f"นำเข้า {len(new_rows)} รายการเรียบร้อย!", icon="✅")
+                        st.rerun()
+
+    st.divider()
+    st.write("### 🧹 บำรุงรักษาชีตการจอง")
+    with st.expander("Compaction (เขียนชีตการจองใหม่ทั้งหมด)"):
+        st.caption("เรียงรายการตามเวลาเริ่มและตัดแถวที่เวลาไม่ถูกต้องออก ควรทำช่วงที่ไม่มีคนใช้งาน")
+        if st.button("🧹 Compact Bookings"):
+            try:
+                save_booking(store, df_book.sort_values("Start_Time").reset_index(drop=True), df_book.attrs.get('revision'))
+            except BookingConflict as e:
+                st.error(f"❌ {', '.join(e.reasons)}")
+            else:
+                st.success("จัดระเบียบเรียบร้อย!")
+                st.rerun()
+
+    with st.expander("📦 เก็บประวัติเก่า (Archive)"):
+        st.caption("ย้ายรายการที่คืนแล้วเกินจำนวนวันที่กำหนดออกจากข้อมูลหลัก (ดูย้อนหลังได้ในตารางการใช้งาน) ทำให้หน้าจองโหลดเร็วขึ้น")
+        archive_days = st.number_input("เก็บรายการที่คืนแล้วเกิน (วัน)", 1, 3650, ARCHIVE_AFTER_DAYS, key="archive_days")
+        if st.button("📦 ย้ายไปเก็บถาวร"):
+            try:
+                moved = store.archive_bookings(pd.Timestamp(now - timedelta(days=archive_days)))
+            except BookingConflict as e:
+                st.error(f"❌ {', '.join(e.reasons)}")
+            else:
+                # Archiving moves bookings without changing usage: the rollups only advance their revision
+                if moved: update_rollups(store, df_book)
+                invalidate_data()
+                st.success(f"ย้าย {moved} รายการไปเก็บถาวรเรียบร้อย!")
+
+    st.divider()
+    st.write("### ⏱️ ประสิทธิภาพระบบ (Performance)")
+    with st.expander("เวลาที่ใช้และจำนวนการเรียก Google API ต่อการทำงาน (เฉพาะโปรเซสนี้)"):
+        perf = get_perf()
+        st.caption(f"เก็บล่าสุด {len(perf.events())} เหตุการณ์ | เรียก Google API ไปแล้ว {perf.api_calls} ครั้งตั้งแต่เริ่มโปรเซส"
+                   + (f" | บันทึกลง `{perf.log_path}`" if perf.log_path else ""))
+        st.dataframe(perf.summary(), use_container_width=True)
+        p1, p2 = st.columns(2)
+        p1.download_button("⬇️ Export (JSON Lines)", "".join(json.dumps(e) + "\n" for e in perf.events()),
+                           file_name=f"navgo_perf_{now.strftime('%Y%m%d_%H%M')}.jsonl", mime="application/json")
+        if p2.button("🗑️ ล้างข้อมูล"):
+            perf.clear()
+            st.rerun()
+
+    if isinstance(store, SQLiteBackend):
+        with st.expander("📥 นำเข้าข้อมูลจาก Google Sheets (CarBookingDB)"):
+            st.caption("คัดลอกการจอง / Stock / รายชื่อ จาก Google Sheets มาแทนที่ข้อมูลในฐานข้อมูล SQLite ทั้งหมด (ทำครั้งเดียวตอนย้ายระบบ)")
+            if st.button("📥 เริ่มนำเข้า"):
+                count = import_backend(SheetsBackend(get_spreadsheet()), store)
+                invalidate_data()
+                st.success(f"นำเข้า {count} รายการเรียบร้อย!")
             
 # --- PAGE: CAR BOOKING ---
-def page_car_booking(df_book, df_stock, df_users, sh):
+def _use_found_slot(start_dt, end_dt):
+    st.session_state.booking_s_date = start_dt.date()
+    st.session_state.booking_s_time = start_dt.time()
+    st.session_state.booking_e_date = end_dt.date()
+    st.session_state.booking_e_time = end_dt.time()
+
+# --- TAB 1 SECTIONS: each reruns on its own (st.fragment), the rest of the page stays as rendered ---
+def _booking_window():
+    ss = st.session_state
+    return datetime.combine(ss.booking_s_date, ss.booking_s_time), datetime.combine(ss.booking_e_date, ss.booking_e_time)
+
+@st.fragment
+@timed("fragment_equipment")
+def equipment_selector(model, df_book, df_stock, store):
+    # Changing a quantity reruns only this grid and the vehicle choice under it
+    check_start_dt, check_end_dt = _booking_window()
+    avail_now = model.available(model.overlapping(check_start_dt, check_end_dt))
+
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        st.subheader("เลือกอุปกรณ์")
+        st.caption(f"ยอดช่วง: {check_start_dt.strftime('%H:%M')} - {check_end_dt.strftime('%H:%M')}")
+
+        selected_equip = {}
+        for item_name, avail in avail_now.items():
+            total = model.stock_totals[item_name]
+
+            cc1, cc2 = st.columns([3, 1])
+            if avail == 0:
+                cc1.markdown(f"🔴 **{item_name}** (หมด)")
+                max_v = 0
+            else:
+                color = "🟢" if avail == total else "🟠"
+                cc1.markdown(f"{color} {item_name} ({avail})")
+                max_v = avail
+
+            qty = cc2.number_input("จำนวน", key=f"q_{item_name}", min_value=0, max_value=max_v, value=0, label_visibility="collapsed", disabled=(max_v==0))
+            if qty > 0: selected_equip[item_name] = qty
+
+    with c2:
+        vehicle_selector(model, df_book, df_stock, store, selected_equip)
+
+@st.fragment
+@timed("fragment_vehicle")
+def vehicle_selector(model, df_book, df_stock, store, selected_equip):
+    # Form fields outside the fragment are read from session state so they are never stale here
+    check_start_dt, check_end_dt = _booking_window()
+    ss = st.session_state
+    user, task, loc, ppl = ss.new_user, ss.new_task, ss.new_loc, ss.new_ppl
+
+    total_load = model.cargo_load(selected_equip)
+    equip_final_str = ", ".join([f"{k} x{v}" for k, v in selected_equip.items()]) if selected_equip else "-"
+
+    st.subheader("3. เลือกพาหนะ")
+    valid_cars = fitting_cars(model.specs, ppl, total_load, model.busy_cars(check_start_dt, check_end_dt))
+
+    sel_car = st.selectbox("เลือก:", valid_cars if valid_cars else ["ไม่มีตัวเลือก"], key="new_car")
+    
+    if st.button("🚀 ยืนยันจอง", type="primary", disabled=(not valid_cars or sel_car == "ไม่มีตัวเลือก")):
+        if check_start_dt >= check_end_dt:
+            st.error("❌ เวลาผิดพลาด")
+        elif not task:
+            st.error("❌ กรุณาระบุภารกิจ")
+        else:
+            new_row = {"User": user, "Task": task, "Car": sel_car, "People": ppl, "Equipment": equip_final_str, "Location": loc, "Start_Time": check_start_dt, "End_Time": check_end_dt}
+            try:
+                commit_booking_change(store, 'add', new_row, df_book, df_stock, model.company_cars)
+            except BookingConflict as e:
+                st.error(f"❌ ช้าไปนิด! มีคนตัดหน้าจองแล้ว ({', '.join(e.reasons)})")
+            else:
+                # --- แจ้งเตือนจองใหม่ (เพิ่มสถานที่) ---
+                msg = (
+                    f"📣 <b>จองใหม่ (NavGo)</b>\n"
+                    f"----------------------------\n"
+                    f"👤 <b>{user}</b>\n"
+                    f"📝 ภารกิจ: {task}\n"
+                    f"📍 <b>สถานที่: {loc}</b>\n"  # <--- เพิ่มตรงนี้
+                    f"🚗 {sel_car}\n"
+                    f"📦 {equip_final_str}\n"
+                    f"----------------------------\n"
+                    f"🟢 <b>วันยืม:</b> {check_start_dt.strftime('%d/%m/%Y %H:%M')}\n"
+                    f"🔴 <b>วันคืน:</b> {check_end_dt.strftime('%d/%m/%Y %H:%M')}"
+                )
+                send_telegram_notify(msg)
+
+                st.toast("บันทึกสำเร็จ!", icon="✅")
+                for k in ['booking_s_time', 'booking_e_time', 'booking_s_date', 'booking_e_date']: del st.session_state[k]
+                st.rerun()
+
+# --- TAB 2 SECTION: filtered and paged before anything is sorted or formatted ---
+SCHEDULE_PAGE_SIZE = 50
+
+@st.fragment
+@timed("fragment_schedule")
+def schedule_table(df_book, model):
+    st.subheader("ตารางการจองทั้งหมด")
+    today = get_thai_time().date()
+    f1, f2, f3, f4 = st.columns(4)
+    sched_from = f1.date_input("ตั้งแต่วันที่", value=today - timedelta(days=30), key="sched_from")
+    sched_to = f2.date_input("ถึงวันที่", value=today + timedelta(days=30), key="sched_to")
+    car_options = list(dict.fromkeys(list(model.specs) + list(model.cars)))
+    sched_car = f3.selectbox("รถ", ["ทั้งหมด"] + car_options, key="sched_car")
+    sched_user = f4.selectbox("ผู้จอง", ["ทั้งหมด"] + sorted(model.users), key="sched_user")
+    car, user = (None if v == "ทั้งหมด" else v for v in (sched_car, sched_user))
+    start, end = pd.Timestamp(sched_from), pd.Timestamp(sched_to + timedelta(days=1))
+
+    # Bookings overlapping the range, then car/user, all on the model's arrays
+    show_df = df_book.iloc[model.matching(model.overlapping(start, end), car, user)]
+    if st.checkbox("📚 รวมประวัติที่เก็บถาวร", key="show_archive"):
+        archive_df = load_archive(start, end)
+        if car is not None: archive_df = archive_df[archive_df['Car'].astype(str) == car]
+        if user is not None: archive_df = archive_df[archive_df['User'].astype(str) == user]
+        archive_df = archive_df[~archive_df['BookingID'].isin(df_book['BookingID'])]
+        if not archive_df.empty: show_df = pd.concat([archive_df, show_df], ignore_index=True)
+    if show_df.empty:
+        st.caption("ไม่มีรายการในช่วงที่เลือก")
+        return
+
+    n_pages = max(1, -(-len(show_df) // SCHEDULE_PAGE_SIZE))
+    sched_page = st.number_input(f"หน้า (ทั้งหมด {len(show_df)} รายการ)", 1, n_pages, 1, key="sched_page") if n_pages > 1 else 1
+    page_df = show_df.sort_values("Start_Time", ascending=False).iloc[(sched_page - 1) * SCHEDULE_PAGE_SIZE: sched_page * SCHEDULE_PAGE_SIZE].copy()
+    page_df['Start_Time'] = page_df['Start_Time'].dt.strftime('%d/%m %H:%M')
+    page_df['End_Time'] = page_df['End_Time'].dt.strftime('%d/%m %H:%M')
+    st.dataframe(page_df[['User', 'Task', 'Location', 'Car', 'Equipment', 'Start_Time', 'End_Time']], use_container_width=True)
+
+@timed("page_car_booking")
+def page_car_booking(df_book, df_stock, df_users, df_cars, store):
     st.title("🚗 NavGo: จองรถและอุปกรณ์")
     st.caption(f"Time: {get_thai_time().strftime('%d/%m/%Y %H:%M')}")
     
@@ -235,144 +628,67 @@ def page_car_booking(df_book, df_stock, df_users, sh):
         st.session_state.booking_s_date = now.date()
         st.session_state.booking_e_date = now.date()
 
-    CAR_SPECS = {
-        "Honda Jazz 2019": {"max_seats": 5, "cargo_score": 1500, "type": "company"},
-        "Isuzu Mu-X": {"max_seats": 7, "cargo_score": 1800, "type": "company"},
-        "Isuzu D-max 4 Doors": {"max_seats": 5, "cargo_score": 2200, "type": "company"},
-        "🚙 รถส่วนตัว (เบิกค่าน้ำมัน)": {"max_seats": 99, "cargo_score": 9999, "type": "private"},
-        "📦 ไม่ใช้รถ (ยืมเฉพาะของ)": {"max_seats": 99, "cargo_score": 9999, "type": "no_car"}
-    }
+    model = get_booking_model(df_book, df_stock, df_cars)
+    CAR_SPECS = model.specs
+    company_cars = model.company_cars
 
-    tab1, tab2, tab3 = st.tabs(["📦 จองใหม่", "📋 ตารางการใช้งาน", "✏️ แก้ไข/ยกเลิก"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📦 จองใหม่", "📋 ตารางการใช้งาน", "✏️ แก้ไข/ยกเลิก", "🔎 หาช่วงว่าง", "🗓️ จองหลายทริป"])
 
     # --- TAB 1: จองใหม่ ---
     with tab1:
-        curr_s_date = st.session_state.booking_s_date
-        curr_s_time = st.session_state.booking_s_time
-        curr_e_date = st.session_state.booking_e_date
-        curr_e_time = st.session_state.booking_e_time
-        check_start_dt = datetime.combine(curr_s_date, curr_s_time)
-        check_end_dt = datetime.combine(curr_e_date, curr_e_time)
-
-        overlap_now = df_book[(df_book['Start_Time'] < check_end_dt) & (df_book['End_Time'] > check_start_dt)]
-        busy_cars_set = set(overlap_now['Car'].str.strip().unique())
-
         c1, c2 = st.columns([1, 1])
         with c1:
             st.subheader("1. รายละเอียด")
             user_list = df_users['Name'].tolist() if not df_users.empty else ["Admin"]
-            user = st.selectbox("ชื่อผู้จอง", user_list, key="new_user")
-            task = st.text_input("ภารกิจ", key="new_task")
-            loc = st.text_input("สถานที่", key="new_loc")
-            ppl = st.number_input("จำนวนคน", 1, 10, 2, key="new_ppl")
-            
-            st.divider()
-            st.subheader("เลือกอุปกรณ์")
-            st.caption(f"ยอดช่วง: {curr_s_time.strftime('%H:%M')} - {curr_e_time.strftime('%H:%M')}")
-            
-            selected_equip = {}
-            if not df_stock.empty:
-                for _, row in df_stock.iterrows():
-                    item_name = row['ItemName']
-                    total = int(row['TotalQty'])
-                    used = sum([parse_equip_str(r['Equipment']).get(item_name, 0) for _, r in overlap_now.iterrows()])
-                    avail = max(0, total - used)
-
-                    cc1, cc2 = st.columns([3, 1])
-                    if avail == 0:
-                        cc1.markdown(f"🔴 **{item_name}** (หมด)")
-                        max_v = 0
-                    else:
-                        color = "🟢" if avail == total else "🟠"
-                        cc1.markdown(f"{color} {item_name} ({avail})")
-                        max_v = avail
-
-                    qty = cc2.number_input("จำนวน", key=f"q_{item_name}", min_value=0, max_value=max_v, value=0, label_visibility="collapsed", disabled=(max_v==0))
-                    if qty > 0: selected_equip[item_name] = qty
+            st.selectbox("ชื่อผู้จอง", user_list, key="new_user")
+            st.text_input("ภารกิจ", key="new_task")
+            st.text_input("สถานที่", key="new_loc")
+            st.number_input("จำนวนคน", 1, 10, 2, key="new_ppl")
 
         with c2:
             st.subheader("2. วันเวลา")
             d1, t1 = st.columns(2)
-            s_date = d1.date_input("เริ่ม", key='booking_s_date')
-            s_time = t1.time_input("เวลาเริ่ม", key='booking_s_time')
+            d1.date_input("เริ่ม", key='booking_s_date')
+            t1.time_input("เวลาเริ่ม", key='booking_s_time')
             d2, t2 = st.columns(2)
-            e_date = d2.date_input("คืน", key='booking_e_date')
-            e_time = t2.time_input("เวลาคืน", key='booking_e_time')
-
-            total_load = sum([(df_stock[df_stock['ItemName']==k]['VolumeScore'].values[0] * v) for k, v in selected_equip.items() if k in df_stock['ItemName'].values])
-            equip_final_str = ", ".join([f"{k} x{v}" for k, v in selected_equip.items()]) if selected_equip else "-"
-
-            st.divider()
-            st.subheader("3. เลือกพาหนะ")
-            valid_cars = []
-            for c_name, specs in CAR_SPECS.items():
-                if specs['max_seats'] >= ppl:
-                    limit = specs['cargo_score'] if "D-max" in c_name or specs['type'] != 'company' else (specs['cargo_score'] - (ppl*20))
-                    if total_load <= limit:
-                        if specs['type'] == 'company':
-                            if c_name not in busy_cars_set: valid_cars.append(c_name)
-                        else:
-                            valid_cars.append(c_name)
+            d2.date_input("คืน", key='booking_e_date')
+            t2.time_input("เวลาคืน", key='booking_e_time')
 
-            sel_car = st.selectbox("เลือก:", valid_cars if valid_cars else ["ไม่มีตัวเลือก"], key="new_car")
-            
-            if st.button("🚀 ยืนยันจอง", type="primary", disabled=(not valid_cars or sel_car == "ไม่มีตัวเลือก")):
-                specs = CAR_SPECS.get(sel_car, {})
-                final_overlap = pd.DataFrame()
-                if specs.get('type') == 'company':
-                    final_overlap = df_book[(df_book['Start_Time'] < check_end_dt) & (df_book['End_Time'] > check_start_dt) & (df_book['Car'] == sel_car)]
-
-                if not final_overlap.empty:
-                    st.error("❌ ช้าไปนิด! มีคนตัดหน้าจองแล้ว")
-                elif check_start_dt >= check_end_dt:
-                    st.error("❌ เวลาผิดพลาด")
-                elif not task:
-                    st.error("❌ กรุณาระบุภารกิจ")
-                else:
-                    new_row = {"User": user, "Task": task, "Car": sel_car, "People": ppl, "Equipment": equip_final_str, "Location": loc, "Start_Time": check_start_dt, "End_Time": check_end_dt}
-                    df_book = pd.concat([df_book, pd.DataFrame([new_row])], ignore_index=True)
-                    save_booking(sh, df_book)
-                    
-                    # --- แจ้งเตือนจองใหม่ (เพิ่มสถานที่) ---
-                    msg = (
-                        f"📣 <b>จองใหม่ (NavGo)</b>\n"
-                        f"----------------------------\n"
-                        f"👤 <b>{user}</b>\n"
-                        f"📝 ภารกิจ: {task}\n"
-                        f"📍 <b>สถานที่: {loc}</b>\n"  # <--- เพิ่มตรงนี้
-                        f"🚗 {sel_car}\n"
-                        f"📦 {equip_final_str}\n"
-                        f"----------------------------\n"
-                        f"🟢 <b>วันยืม:</b> {check_start_dt.strftime('%d/%m/%Y %H:%M')}\n"
-                        f"🔴 <b>วันคืน:</b> {check_end_dt.strftime('%d/%m/%Y %H:%M')}"
-                    )
-                    send_telegram_notify(msg)
-                    
-                    st.success("บันทึกสำเร็จ!")
-                    for k in ['booking_s_time', 'booking_e_time', 'booking_s_date', 'booking_e_date']: del st.session_state[k]
-                    time.sleep(1)
-                    st.rerun()
+        st.divider()
+        equipment_selector(model, df_book, df_stock, store)
 
     # --- TAB 2: TABLE ---
     with tab2:
-        st.subheader("ตารางการจองทั้งหมด")
-        if not df_book.empty:
-            show_df = df_book.sort_values("Start_Time", ascending=False).copy()
-            show_df['Start_Time'] = show_df['Start_Time'].dt.strftime('%d/%m %H:%M')
-            show_df['End_Time'] = show_df['End_Time'].dt.strftime('%d/%m %H:%M')
-            st.dataframe(show_df[['User', 'Task', 'Location', 'Car', 'Equipment', 'Start_Time', 'End_Time']], use_container_width=True)
+        schedule_table(df_book, model)
 
     # --- TAB 3: EDIT / DELETE ---
     with tab3:
         st.header("✏️ แก้ไข หรือ ยกเลิก")
         if not df_book.empty:
-            manage_df = df_book.sort_values("Start_Time", ascending=False)
-            booking_options = manage_df['Display'].tolist()
-            selected_booking_str = st.selectbox("เลือกรายการ:", booking_options)
-            
-            if selected_booking_str:
-                row_idx = df_book[df_book['Display'] == selected_booking_str].index[0]
-                row_data = df_book.loc[row_idx]
+            today = get_thai_time().date()
+            m1, m2, m3 = st.columns(3)
+            manage_user = m1.selectbox("ผู้จอง", ["ทั้งหมด"] + sorted(df_book['User'].astype(str).unique()), key="manage_user")
+            manage_from = m2.date_input("ตั้งแต่วันที่", value=today, key="manage_from")
+            manage_to = m3.date_input("ถึงวันที่", value=today + timedelta(days=30), key="manage_to")
+
+            # Only bookings still running on/after manage_from: a binary-search slice of the End_Time view
+            view = get_end_time_view(df_book)
+            manage_df = view.iloc[view.index.searchsorted(pd.Timestamp(manage_from)):]
+            manage_df = manage_df[manage_df['Start_Time'] < pd.Timestamp(manage_to + timedelta(days=1))]
+            if manage_user != "ทั้งหมด": manage_df = manage_df[manage_df['User'].astype(str) == manage_user]
+            manage_df = manage_df.sort_values("Start_Time")
+
+            page_size = 20
+            n_pages = max(1, -(-len(manage_df) // page_size))
+            manage_page = st.number_input(f"หน้า (ทั้งหมด {len(manage_df)} รายการ)", 1, n_pages, 1, key="manage_page") if n_pages > 1 else 1
+            page_df = manage_df.iloc[(manage_page - 1) * page_size: manage_page * page_size]
+            labels = dict(zip(page_df['BookingID'], booking_labels(page_df)))
+            selected_id = st.selectbox("เลือกรายการ:", list(labels), format_func=labels.get)
+            if not labels: st.caption("ไม่มีรายการในช่วงที่เลือก")
+
+            row_data = get_booking_row(df_book, selected_id) if selected_id else None
+            if row_data is not None:
+                row_idx = row_data.name
 
                 st.info(f"รายการ: **{row_data['Task']}** ({row_data['User']})")
                 action = st.radio("Action:", ["❌ ยกเลิก (Delete)", "📝 แก้ไข (Edit)"], horizontal=True)
@@ -380,14 +696,16 @@ def page_car_booking(df_book, df_stock, df_users, sh):
                 if action == "❌ ยกเลิก (Delete)":
                     st.warning("ยืนยันที่จะลบ?")
                     if st.button("ยืนยันลบ", type="primary"):
-                        df_book = df_book.drop(row_idx)
-                        save_booking(sh, df_book)
-                        # --- แจ้งเตือนลบ (เพิ่มสถานที่) ---
-                        msg = f"❌ <b>ยกเลิกการจอง</b>\n👤 {row_data['User']}\n📝 {row_data['Task']}\n📍 {row_data['Location']}\n🚗 {row_data['Car']}"
-                        send_telegram_notify(msg)
-                        st.success("ลบเรียบร้อย!")
-                        time.sleep(1)
-                        st.rerun()
+                        try:
+                            commit_booking_change(store, 'cancel', {"BookingID": row_data['BookingID']}, df_book, df_stock, company_cars)
+                        except BookingConflict as e:
+                            st.error(f"❌ {', '.join(e.reasons)}")
+                        else:
+                            # --- แจ้งเตือนลบ (เพิ่มสถานที่) ---
+                            msg = f"❌ <b>ยกเลิกการจอง</b>\n👤 {row_data['User']}\n📝 {row_data['Task']}\n📍 {row_data['Location']}\n🚗 {row_data['Car']}"
+                            send_telegram_notify(msg)
+                            st.toast("ลบเรียบร้อย!", icon="✅")
+                            st.rerun()
 
                 elif action == "📝 แก้ไข (Edit)":
                     st.write("--- แก้ไข ---")
@@ -405,50 +723,36 @@ def page_car_booking(df_book, df_stock, df_users, sh):
                         ed_task = st.text_input("ภารกิจ", value=row_data['Task'])
                         ed_loc = st.text_input("สถานที่", value=row_data['Location'])
                     with c_ed2:
-                        ed_car = st.selectbox("รถ", list(CAR_SPECS.keys()), index=list(CAR_SPECS.keys()).index(row_data['Car']) if row_data['Car'] in CAR_SPECS else 0)
+                        ed_car = st.selectbox("รถ", list(CAR_SPECS), index=model.car_pos.get(row_data['Car'], 0))
                         ed_ppl = st.number_input("คน", 1, 10, int(row_data['People']))
 
                     st.write("--- อุปกรณ์ (คำนวณ Stock ใหม่) ---")
                     current_equip_dict = parse_equip_str(row_data['Equipment'])
-                    other_overlaps = df_book[(df_book.index != row_idx) & (df_book['Start_Time'] < new_end_dt) & (df_book['End_Time'] > new_start_dt)]
+                    other_overlaps = model.overlapping(new_start_dt, new_end_dt)
+                    other_overlaps = other_overlaps[model.labels[other_overlaps] != row_idx]
                     
                     edited_equip_result = {}
-                    if not df_stock.empty:
+                    if model.stock_items:
                         cols = st.columns(3)
-                        for i, (idx_stock, stock_row) in enumerate(df_stock.iterrows()):
-                            item_name = stock_row['ItemName']
-                            total_qty = int(stock_row['TotalQty'])
-                            used_by_others = sum([parse_equip_str(r['Equipment']).get(item_name, 0) for _, r in other_overlaps.iterrows()])
-                            max_avail = max(0, total_qty - used_by_others)
+                        for i, (item_name, max_avail) in enumerate(model.available(other_overlaps).items()):
                             default_val = min(current_equip_dict.get(item_name, 0), max_avail)
                             
                             with cols[i % 3]:
-                                new_qty = st.number_input(f"{item_name} (ว่าง {max_avail})", 0, max_avail, default_val, key=f"ed_{row_idx}_{item_name}")
+                                new_qty = st.number_input(f"{item_name} (ว่าง {max_avail})", 0, max_avail, default_val, key=f"ed_{row_data['BookingID']}_{item_name}")
                                 if new_qty > 0: edited_equip_result[item_name] = new_qty
                     
                     if st.button("💾 บันทึกแก้ไข", type="primary"):
                         if new_start_dt >= new_end_dt:
                             st.error("เวลาคืนต้องหลังเวลาเริ่ม")
                         else:
-                            specs = CAR_SPECS.get(ed_car, {})
-                            is_conflict = False
-                            if specs.get('type') == 'company':
-                                car_conflict = df_book[(df_book.index != row_idx) & (df_book['Car'] == ed_car) & (df_book['Start_Time'] < new_end_dt) & (df_book['End_Time'] > new_start_dt)]
-                                if not car_conflict.empty: is_conflict = True
-                            
-                            if is_conflict:
-                                st.error(f"❌ รถ {ed_car} ไม่ว่างช่วงใหม่นี้")
+                            new_equip_str = ", ".join([f"{k} x{v}" for k, v in edited_equip_result.items()]) if edited_equip_result else "-"
+                            updated_row = row_data.to_dict()
+                            updated_row.update({"Task": ed_task, "Location": ed_loc, "Car": ed_car, "People": ed_ppl, "Start_Time": new_start_dt, "End_Time": new_end_dt, "Equipment": new_equip_str})
+                            try:
+                                commit_booking_change(store, 'edit', updated_row, df_book, df_stock, company_cars)
+                            except BookingConflict as e:
+                                st.error(f"❌ บันทึกไม่ได้: {', '.join(e.reasons)}")
                             else:
-                                new_equip_str = ", ".join([f"{k} x{v}" for k, v in edited_equip_result.items()]) if edited_equip_result else "-"
-                                df_book.at[row_idx, 'Task'] = ed_task
-                                df_book.at[row_idx, 'Location'] = ed_loc
-                                df_book.at[row_idx, 'Car'] = ed_car
-                                df_book.at[row_idx, 'People'] = ed_ppl
-                                df_book.at[row_idx, 'Start_Time'] = new_start_dt
-                                df_book.at[row_idx, 'End_Time'] = new_end_dt
-                                df_book.at[row_idx, 'Equipment'] = new_equip_str
-                                save_booking(sh, df_book)
-                                
                                 # --- แจ้งเตือนแก้ไข (เพิ่มสถานที่) ---
                                 msg = (
                                     f"✏️ <b>แก้ไขรายการ (NavGo)</b>\n"
@@ -461,25 +765,183 @@ def page_car_booking(df_book, df_stock, df_users, sh):
                                     f"🔴 <b>วันคืนใหม่:</b> {new_end_dt.strftime('%d/%m/%Y %H:%M')}"
                                 )
                                 send_telegram_notify(msg)
-                                st.success("แก้ไขเรียบร้อย!")
-                                time.sleep(1)
+                                st.toast("แก้ไขเรียบร้อย!", icon="✅")
                                 st.rerun()
         else:
             st.info("ไม่มีรายการ")
 
+    # --- TAB 4: FIND A SLOT ---
+    with tab4:
+        st.header("🔎 หาช่วงเวลาว่าง")
+        st.caption("ค้นหาช่วงที่รถและอุปกรณ์ว่างพร้อมกันเร็วที่สุด (คำนวณจากข้อมูลที่โหลดไว้แล้ว)")
+        today = get_thai_time().date()
+        f1, f2, f3 = st.columns(3)
+        find_from = f1.date_input("ตั้งแต่วันที่", value=today, key="find_from")
+        find_to = f2.date_input("ถึงวันที่", value=today + timedelta(days=14), key="find_to")
+        find_hours = f3.number_input("ระยะเวลา (ชั่วโมง)", 1, 24 * 14, 4, key="find_hours")
+
+        need_car = st.checkbox("ต้องใช้รถบริษัท", value=True, key="find_need_car")
+        find_cars = st.multiselect("รถที่ต้องการ (ไม่เลือก = คันไหนก็ได้)", company_cars, key="find_cars") if need_car else []
+        find_items = st.multiselect("อุปกรณ์ที่ต้องการ", df_stock['ItemName'].tolist() if not df_stock.empty else [], key="find_items")
+        need_items = {}
+        if find_items:
+            q_cols = st.columns(4)
+            for i, item_name in enumerate(find_items):
+                need_items[item_name] = q_cols[i % 4].number_input(item_name, 1, 999, 1, key=f"find_q_{item_name}")
+
+        range_start = datetime.combine(find_from, datetime.min.time())
+        range_end = datetime.combine(find_to + timedelta(days=1), datetime.min.time())
+        if range_start >= range_end:
+            st.error("❌ ช่วงวันที่ไม่ถูกต้อง")
+        else:
+            timeline = get_availability_timeline(df_book, model, company_cars, range_start, range_end)
+            not_before = (get_thai_time() + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+            slot = timeline.earliest_slot(find_hours, (find_cars or company_cars) if need_car else None, need_items, not_before=not_before)
+            if slot is None:
+                st.warning("ไม่พบช่วงที่ว่างพร้อมกันในช่วงวันที่เลือก")
+            else:
+                slot_car, slot_s, slot_e = slot
+                st.success(f"✅ ว่างเร็วที่สุด: {slot_s.strftime('%d/%m/%Y %H:%M')} - {slot_e.strftime('%d/%m/%Y %H:%M')}" + (f" | 🚗 {slot_car}" if slot_car else ""))
+                st.button("📌 ใช้ช่วงเวลานี้ในแท็บจองใหม่", on_click=_use_found_slot, args=(slot_s.to_pydatetime(), slot_e.to_pydatetime()))
+
+            with st.expander("📈 จำนวนที่ว่างตลอดช่วง"):
+                if find_items: st.line_chart(timeline.items[find_items])
+                if need_car: st.line_chart(timeline.cars[find_cars or company_cars])
+
+    # --- TAB 5: BATCH PLANNING ---
+    with tab5:
+        st.header("🗓️ จองหลายทริปพร้อมกัน")
+        st.caption("กรอกทริปทั้งหมด แล้วให้ระบบจัดรถบริษัทและตรวจอุปกรณ์ให้ในครั้งเดียว (อุปกรณ์เขียนแบบ `GPS x2, Drone x1` / จำนวนคน 0 = ไม่ใช้รถ)")
+        if 'batch_template' not in st.session_state:
+            next_hour = (get_thai_time() + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+            st.session_state.batch_template = pd.DataFrame([{"User": df_users['Name'].iloc[0] if not df_users.empty else "Admin", "Task": "", "Location": "",
+                                                             "People": 2, "Equipment": "-", "Start_Time": next_hour, "End_Time": next_hour + timedelta(hours=4)}])
+        trips = st.data_editor(st.session_state.batch_template, num_rows="dynamic", use_container_width=True, key="batch_trips", column_config={
+            "User": st.column_config.SelectboxColumn("ผู้จอง", options=df_users['Name'].tolist() if not df_users.empty else ["Admin"], required=True),
+            "People": st.column_config.NumberColumn("จำนวนคน", min_value=0, max_value=99, step=1, required=True),
+            "Start_Time": st.column_config.DatetimeColumn("เริ่ม", format="DD/MM/YYYY HH:mm", required=True),
+            "End_Time": st.column_config.DatetimeColumn("คืน", format="DD/MM/YYYY HH:mm", required=True),
+        })
+        trips = trips.dropna(subset=["Start_Time", "End_Time", "People"]).reset_index(drop=True)
+        trips['Start_Time'], trips['End_Time'] = pd.to_datetime(trips['Start_Time']), pd.to_datetime(trips['End_Time'])
+        trips['Equipment'] = trips['Equipment'].fillna("-").astype(str)
+
+        if st.button("🧮 จัดรถอัตโนมัติ", disabled=trips.empty):
+            plan = TripPlan(get_booking_index(df_book), get_equipment_table(df_book), model.stock_totals, company_cars)
+            st.session_state.batch_plan = (trips, allocate_trips(trips, CAR_SPECS, plan, model.volumes))
+
+        planned_for, result = st.session_state.get("batch_plan", (None, None))
+        if result is not None and planned_for.equals(trips):
+            st.dataframe(result, use_container_width=True)
+            ok = result[result['Car'].notna()]
+            if len(ok) < len(result): st.warning(f"⚠️ จัดไม่ได้ {len(result) - len(ok)} ทริป (ดูคอลัมน์ Problem)")
+            if st.button(f"🚀 ยืนยันจอง {len(ok)} ทริป", type="primary", disabled=ok.empty):
+                rows = [{"User": r['User'], "Task": r['Task'] or "-", "Car": r['Car'], "People": int(r['People']), "Equipment": r['Equipment'],
+                         "Location": r['Location'] or "", "Start_Time": r['Start_Time'].to_pydatetime(), "End_Time": r['End_Time'].to_pydatetime()}
+                        for _, r in ok.iterrows()]
+                try:
+                    commit_booking_batch(store, rows, df_book, df_stock, company_cars)
+                except BookingConflict as e:
+                    st.error(f"❌ ข้อมูลเปลี่ยนระหว่างจัดรถ กรุณากดจัดรถใหม่ ({', '.join(e.reasons)})")
+                else:
+                    send_telegram_notify(batch_summary_msg("จองหลายทริป", rows))
+                    del st.session_state.batch_plan
+                    st.toast(f"บันทึก {len(rows)} ทริปเรียบร้อย!", icon="✅")
+                    st.rerun()
+        elif result is not None:
+            st.info("ข้อมูลทริปเปลี่ยนไป กรุณากดจัดรถอีกครั้ง")
+
+# --- PAGE: UTILIZATION ---
+@timed("page_analytics")
+def page_analytics(df_book, df_stock, df_users, df_cars, store):
+    st.title("📈 สถิติการใช้งานรถและอุปกรณ์")
+    rollups = get_rollups()
+    rev = store.revision()
+    if rollups.revision() != rev:
+        with st.spinner("กำลังคำนวณสรุปการใช้งานจากประวัติทั้งหมด..."):
+            rollups.rebuild(with_archive(store.read_archive(), store.read_bookings()), rev)
+
+    today = get_thai_time().date()
+    a1, a2 = st.columns(2)
+    an_from = a1.date_input("ตั้งแต่วันที่", value=today - timedelta(days=90), key="an_from")
+    an_to = a2.date_input("ถึงวันที่", value=today, key="an_to")
+    if an_from > an_to:
+        st.error("❌ ช่วงวันที่ไม่ถูกต้อง")
+        return
+    days = pd.date_range(an_from, an_to, freq='D')
+    daily = rollups.daily(an_from, an_to + timedelta(days=1))
+
+    def per_day(kind, keys=None):
+        part = daily[daily['Kind'] == kind]
+        table = part.pivot_table(index='Day', columns='Key', values='Value', aggfunc='sum')
+        return table.reindex(index=days, columns=keys if keys is not None else table.columns).fillna(0).rename_axis(columns=None)
+
+    # ------------------------------------------------
+    # 1. CARS
+    # ------------------------------------------------
+    st.write("### 🚗 การใช้รถบริษัท")
+    company_cars = [c for c, spec in car_specs(df_cars).items() if spec['type'] == 'company']
+    car_hours = per_day('car_hours', company_cars)
+    st.line_chart(car_hours / 24 * 100, y_label="% ของวันที่ถูกจอง")
+    st.dataframe(pd.DataFrame({
+        "ชั่วโมงที่จอง": car_hours.sum().round(1),
+        "จำนวนครั้ง": per_day('car_bookings', company_cars).sum().astype(int),
+        "อัตราการใช้ (%)": (car_hours.sum() / (24 * len(days)) * 100).round(1),
+    }), use_container_width=True)
+
+    # ------------------------------------------------
+    # 2. EQUIPMENT
+    # ------------------------------------------------
+    st.write("### 📦 การใช้อุปกรณ์")
+    items = df_stock['ItemName'].tolist() if not df_stock.empty else []
+    avg_out = per_day('item_qty_hours', items) / 24
+    peak_out = rollups.item_peaks(an_from, an_to + timedelta(days=1)).reindex(index=days, columns=items).fillna(0)
+    totals = pd.Series(get_stock_totals(df_stock), dtype='int64').reindex(items)
+    st.dataframe(pd.DataFrame({
+        "ทั้งหมด": totals,
+        "ใช้เฉลี่ย/วัน": avg_out.mean().round(2),
+        "ใช้สูงสุด": peak_out.max().astype(int),
+        "สูงสุด/ทั้งหมด (%)": (peak_out.max() / totals.where(totals > 0) * 100).round(0),
+    }).sort_values("สูงสุด/ทั้งหมด (%)", ascending=False), use_container_width=True)
+    chart_items = st.multiselect("ดูรายวัน", items, default=items[:3], key="an_items")
+    if chart_items:
+        i1, i2 = st.columns(2)
+        i1.caption("ใช้สูงสุดต่อวัน")
+        i1.line_chart(peak_out[chart_items])
+        i2.caption("ใช้เฉลี่ยต่อวัน")
+        i2.line_chart(avg_out[chart_items])
+
+    # ------------------------------------------------
+    # 3. USERS / DEPARTMENTS
+    # ------------------------------------------------
+    st.write("### 👥 การจองตามผู้ใช้ / แผนก")
+    per_user = pd.DataFrame({"จำนวนครั้ง": per_day('user_bookings').sum(), "ชั่วโมง": per_day('user_hours').sum().round(1)}).fillna(0)
+    per_user["จำนวนครั้ง"] = per_user["จำนวนครั้ง"].astype(int)
+    dept = df_users.drop_duplicates('Name').set_index('Name')['Department'] if not df_users.empty else pd.Series(dtype=str)
+    per_user["แผนก"] = dept.reindex(per_user.index).fillna("-")
+    u1, u2 = st.columns(2)
+    u1.bar_chart(per_user.groupby("แผนก")["จำนวนครั้ง"].sum())
+    u2.dataframe(per_user.sort_values("จำนวนครั้ง", ascending=False), use_container_width=True)
+
 # --- MAIN ---
+start_notifier()
 try:
-    df_book, df_stock, df_users, sh = load_data()
+    df_book, df_stock, df_users, df_cars, store = load_data()
     with st.sidebar:
         st.header("NavGo Menu")
-        page = st.radio("ไปที่หน้า:", ["🚗 จองรถ & อุปกรณ์", "🛠️ Admin & Stock"])
+        page = st.radio("ไปที่หน้า:", ["🚗 จองรถ & อุปกรณ์", "🛠️ Admin & Stock", "📈 สถิติการใช้งาน"])
         st.write("---")
         st.caption(f"Time: {get_thai_time().strftime('%H:%M')}")
+        if st.button("🔄 โหลดข้อมูลใหม่"):
+            invalidate_data()
+            st.rerun()
 
     if page == "🚗 จองรถ & อุปกรณ์":
-        page_car_booking(df_book, df_stock, df_users, sh)
+        page_car_booking(df_book, df_stock, df_users, df_cars, store)
+    elif page == "📈 สถิติการใช้งาน":
+        page_analytics(df_book, df_stock, df_users, df_cars, store)
     else:
-        page_admin(df_book, df_stock, df_users, sh)
+        page_admin(df_book, df_stock, df_users, df_cars, store)
 
 except Exception as e:
     st.error(f"Error: {e}")
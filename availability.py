@@ -0,0 +1,334 @@
+"""Availability helpers for NavGo: overlap index and equipment usage over bookings."""
+from bisect import bisect_left, insort
+
+import numpy as np
+import pandas as pd
+
+# Bookings longer than this are kept aside so they don't widen every lookup window
+LONG_SPAN_NS = pd.Timedelta(days=7).value
+
+
+def parse_equip_str(equip_str):
+    if not equip_str or equip_str in ["-", "nan", ""]: return {}
+    items = {}
+    for part in equip_str.split(','):
+        if ' x' in part:
+            try:
+                name, qty = part.strip().rsplit(' x', 1) 
+                items[name.strip()] = int(qty)
+            except: continue
+    return items
+
+
+def build_equipment_table(df_book):
+    """Long table of (booking label -> ItemName, Qty), parsed once from the "Item xN" strings."""
+    empty = pd.DataFrame({'ItemName': pd.Series(dtype=str), 'Qty': pd.Series(dtype='int64')})
+    if df_book.empty or 'Equipment' not in df_book.columns: return empty
+    parts = df_book['Equipment'].astype(str).str.split(',').explode().str.strip()
+    parts = parts[parts.str.contains(' x', regex=False, na=False)]
+    if parts.empty: return empty
+    split = parts.str.rsplit(' x', n=1, expand=True)
+    qty = split[1].str.strip()
+    ok = qty.str.fullmatch(r'[+-]?\d+', na=False)
+    table = pd.DataFrame({'ItemName': split[0][ok].str.strip(), 'Qty': qty[ok].astype('int64')})
+    # parse_equip_str keeps the last quantity when an item is repeated in one string
+    table = table.assign(_key=table.index).drop_duplicates(subset=['_key', 'ItemName'], keep='last')
+    return table.drop(columns='_key')
+
+
+def equipment_usage(equip_table, keys):
+    """Total quantity out per ItemName across the given booking labels, in one group-sum."""
+    if equip_table.empty or len(keys) == 0: return pd.Series(dtype='int64')
+    pos = equip_table.index.get_indexer_for(list(keys))
+    rows = equip_table.iloc[pos[pos >= 0]]
+    return rows.groupby('ItemName')['Qty'].sum()
+
+
+def stock_status(df_stock, equip_table, keys):
+    """Total / Used / Available per ItemName with the given booking labels out."""
+    if df_stock.empty: return pd.DataFrame(columns=["Total", "Used", "Available"])
+    stock = df_stock.drop_duplicates('ItemName', keep='last').set_index('ItemName')
+    status = pd.DataFrame({"Total": stock['TotalQty'].astype(int)})
+    used = equipment_usage(equip_table, keys)
+    status['Used'] = used.reindex(status.index, fill_value=0).astype(int)
+    status['Available'] = status['Total'] - status['Used']
+    status.index.name = None
+    return status
+
+
+def stock_volumes(df_stock):
+    # ItemName -> VolumeScore (first row wins, like the original per-item lookup)
+    if df_stock.empty: return {}
+    return df_stock.drop_duplicates('ItemName', keep='first').set_index('ItemName')['VolumeScore'].to_dict()
+
+
+def cargo_load(df_stock, selected_equip, volumes=None):
+    # Sum of VolumeScore x qty; items missing from StockMaster weigh nothing
+    if not selected_equip: return 0
+    if volumes is None: volumes = stock_volumes(df_stock)
+    return sum(volumes[k] * v for k, v in selected_equip.items() if k in volumes)
+
+
+def cargo_limit(specs, ppl):
+    # Cargo room left once `ppl` passengers are seated
+    return specs['cargo_score'] - specs.get('cargo_per_person', 0) * ppl
+
+
+def fits_car(specs, ppl, total_load):
+    return specs['max_seats'] >= ppl and total_load <= cargo_limit(specs, ppl)
+
+
+def fitting_cars(car_specs, ppl, total_load, busy_cars):
+    """Cars (in car_specs order) with enough seats and cargo room; busy company cars are left out."""
+    return [c for c, specs in car_specs.items()
+            if fits_car(specs, ppl, total_load) and not (specs['type'] == 'company' and c in busy_cars)]
+
+
+def peak_usage(usage, queries):
+    """Highest concurrent quantity of each query's resource anywhere in its [Start_Time, End_Time).
+
+    usage: one row per (resource, quantity, interval) held, queries included; queries:
+    (Res, Start_Time, End_Time). One sorted sweep over all start/end events answers every
+    query with a range-max, so there is no per-row loop.
+    """
+    if queries.empty: return np.zeros(0, dtype='int64')
+    res = pd.Index(pd.unique(pd.concat([usage['Res'], queries['Res']])))
+    times = np.unique(np.concatenate([usage['Start_Time'].to_numpy('datetime64[ns]'), usage['End_Time'].to_numpy('datetime64[ns]'),
+                                      queries['Start_Time'].to_numpy('datetime64[ns]'), queries['End_Time'].to_numpy('datetime64[ns]')]))
+    width = len(times) + 1
+
+    def key(r, t):
+        # (resource, time) packed into one sortable int64
+        return res.get_indexer(r) * width + np.searchsorted(times, t.to_numpy('datetime64[ns]'))
+
+    qty = usage['Qty'].to_numpy('int64')
+    ev_key = np.concatenate([key(usage['Res'], usage['Start_Time']), key(usage['Res'], usage['End_Time'])])
+    delta = np.concatenate([qty, -qty])
+    order = np.argsort(ev_key, kind='stable')
+    ev_key = ev_key[order]
+    # Every resource's events sum to zero, so one running total restarts at 0 per resource;
+    # only the level after the last event of an instant counts
+    level = np.cumsum(delta[order])
+    level = np.append(np.where(np.append(ev_key[1:] != ev_key[:-1], True), level, np.iinfo('int64').min), 0)
+    lo = np.searchsorted(ev_key, key(queries['Res'], queries['Start_Time']), 'left')
+    hi = np.searchsorted(ev_key, key(queries['Res'], queries['End_Time']), 'left')
+    bounds = np.empty(2 * len(lo), dtype='int64')
+    bounds[0::2], bounds[1::2] = lo, hi
+    peak = np.maximum.reduceat(level, bounds)[0::2]
+    return np.where(lo < hi, peak, 0)
+
+
+def _ns(t):
+    return pd.Timestamp(t).value
+
+
+class IntervalIndex:
+    """Sorted-start index answering "which intervals overlap [start, end)" in O(log n + k)."""
+
+    def __init__(self):
+        self._entries = []   # sorted (start_ns, key)
+        self._spans = {}     # key -> (start_ns, end_ns)
+        self._long = {}      # key -> (start_ns, end_ns) for spans over LONG_SPAN_NS
+        self._max_span = 0
+
+    @classmethod
+    def from_arrays(cls, keys, starts, ends):
+        """Bulk build from int64 epoch-ns arrays: one sort instead of an insort per interval."""
+        idx = cls()
+        span = ends - starts
+        long = span > LONG_SPAN_NS
+        idx._spans = dict(zip(keys, zip(starts.tolist(), ends.tolist())))
+        idx._long = {keys[i]: idx._spans[keys[i]] for i in np.flatnonzero(long).tolist()}
+        short = np.flatnonzero(~long)
+        short = short[np.argsort(starts[short], kind='stable')].tolist()
+        # Already in start order, so this sort only settles ties by key (what remove() bisects on)
+        idx._entries = sorted(zip(starts[short].tolist(), [keys[i] for i in short]))
+        idx._max_span = int(span[short].max()) if short else 0
+        return idx
+
+    def copy(self):
+        idx = IntervalIndex()
+        idx._entries, idx._spans, idx._long = list(self._entries), dict(self._spans), dict(self._long)
+        idx._max_span = self._max_span
+        return idx
+
+    def __len__(self):
+        return len(self._spans)
+
+    def add(self, key, start, end):
+        if key in self._spans: self.remove(key)
+        s, e = _ns(start), _ns(end)
+        self._spans[key] = (s, e)
+        if e - s > LONG_SPAN_NS:
+            self._long[key] = (s, e)
+        else:
+            insort(self._entries, (s, key))
+            self._max_span = max(self._max_span, e - s)
+
+    def remove(self, key):
+        span = self._spans.pop(key, None)
+        if span is None: return
+        if self._long.pop(key, None) is None:
+            i = bisect_left(self._entries, (span[0], key))
+            del self._entries[i]
+
+    def overlapping(self, start, end, closed=False):
+        # closed=False: start < end_q and end > start_q; closed=True: start <= end_q and end >= start_q
+        qs, qe = _ns(start), _ns(end)
+        lo = bisect_left(self._entries, (qs - self._max_span,))
+        hi = bisect_left(self._entries, (qe + 1,) if closed else (qe,))
+        keys = []
+        for s, key in self._entries[lo:hi]:
+            e = self._spans[key][1]
+            if e >= qs if closed else e > qs: keys.append(key)
+        for key, (s, e) in self._long.items():
+            if (s <= qe and e >= qs) if closed else (s < qe and e > qs): keys.append(key)
+        return keys
+
+
+class BookingIndex:
+    """Per-car interval indexes plus one over all bookings, keyed by df_book index label."""
+
+    def __init__(self):
+        self._all = IntervalIndex()
+        self._by_car = {}
+        self._car_of = {}
+
+    @classmethod
+    def from_frame(cls, df_book):
+        idx = cls()
+        if df_book.empty: return idx
+        keys = df_book.index.tolist()
+        cars = df_book['Car'].astype(str).str.strip()
+        starts = df_book['Start_Time'].to_numpy('datetime64[ns]').view('int64')
+        ends = df_book['End_Time'].to_numpy('datetime64[ns]').view('int64')
+        idx._all = IntervalIndex.from_arrays(keys, starts, ends)
+        idx._car_of = dict(zip(keys, cars.tolist()))
+        for car, pos in cars.groupby(cars.to_numpy(), sort=False).indices.items():
+            idx._by_car[car] = IntervalIndex.from_arrays([keys[i] for i in pos], starts[pos], ends[pos])
+        return idx
+
+    def copy(self):
+        # Independent copy to apply a commit to while the cached original is still being read
+        idx = BookingIndex()
+        idx._all = self._all.copy()
+        idx._by_car = {car: tree.copy() for car, tree in self._by_car.items()}
+        idx._car_of = dict(self._car_of)
+        return idx
+
+    def __len__(self):
+        return len(self._all)
+
+    def add(self, key, car, start, end):
+        self.remove(key)
+        car = str(car).strip()
+        self._all.add(key, start, end)
+        self._by_car.setdefault(car, IntervalIndex()).add(key, start, end)
+        self._car_of[key] = car
+
+    def remove(self, key):
+        car = self._car_of.pop(key, None)
+        if car is None: return
+        self._all.remove(key)
+        self._by_car[car].remove(key)
+
+    def overlapping(self, start, end, car=None, exclude=None, closed=False):
+        if car is None:
+            tree = self._all
+        else:
+            tree = self._by_car.get(str(car).strip())
+            if tree is None: return []
+        return [k for k in tree.overlapping(start, end, closed) if k != exclude]
+
+    def active_at(self, t):
+        return self.overlapping(t, t, closed=True)
+
+    def busy_cars(self, start, end, exclude=None):
+        return {self._car_of[k] for k in self.overlapping(start, end, exclude=exclude)}
+
+
+class AvailabilityTimeline:
+    """Step functions of free capacity per company car and per stock item over [start, end).
+
+    Row i of `cars` / `items` holds the free count from times[i] until times[i + 1] (or `end`).
+    `keys` are the df_book labels of the bookings overlapping [start, end).
+    """
+
+    def __init__(self, times, cars, items, start, end):
+        self.times = times
+        self.cars = cars
+        self.items = items
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def build(cls, df_book, equip_table, keys, stock_totals, car_names, start, end):
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        book = df_book.loc[keys, ['Car', 'Start_Time', 'End_Time']]
+        s = book['Start_Time'].clip(lower=start)
+        e = book['End_Time'].clip(upper=end)
+
+        # One event per booking edge: -qty when it leaves, +qty when it comes back
+        busy = book['Car'].isin(car_names)
+        car_ev = pd.DataFrame({'time': pd.concat([s[busy], e[busy]]), 'res': pd.concat([book['Car'][busy]] * 2),
+                               'delta': [-1] * int(busy.sum()) + [1] * int(busy.sum())})
+        pos = equip_table.index.get_indexer_for(keys) if len(keys) else []
+        eq = equip_table.iloc[[p for p in pos if p >= 0]]
+        eq = eq[eq['ItemName'].isin(list(stock_totals))]
+        item_ev = pd.DataFrame({'time': pd.concat([s.loc[eq.index], e.loc[eq.index]]), 'res': pd.concat([eq['ItemName']] * 2),
+                                'delta': pd.concat([-eq['Qty'], eq['Qty']])})
+
+        times = pd.DatetimeIndex([start]).append(pd.DatetimeIndex(pd.concat([car_ev['time'], item_ev['time']])))
+        times = times[times < end].unique().sort_values()
+
+        def sweep(ev, columns, base):
+            if ev.empty:
+                steps = pd.DataFrame(0, index=times, columns=columns)
+            else:
+                steps = ev.pivot_table(index='time', columns='res', values='delta', aggfunc='sum')
+                steps = steps.reindex(index=times, columns=columns).fillna(0).cumsum()
+            return (steps + pd.Series(base, index=columns, dtype='int64')).astype('int64').rename_axis(columns=None)
+
+        cars = sweep(car_ev, list(car_names), {c: 1 for c in car_names})
+        items = sweep(item_ev, list(stock_totals), stock_totals)
+        return cls(times, cars, items, start, end)
+
+    def earliest_slot(self, hours, cars=None, items=None, not_before=None):
+        """Earliest (car, start, end) window of `hours` where the car and all items are free.
+
+        `cars` is a list of candidates (any of them will do); None means no car is needed.
+        """
+        items = {k: v for k, v in (items or {}).items() if v > 0}
+        if any(k not in self.items.columns for k in items): return None
+        ok = pd.Series(True, index=self.times)
+        for k, qty in items.items():
+            ok &= self.items[k] >= qty
+        duration = pd.Timedelta(hours=hours)
+        not_before = max(self.start, pd.Timestamp(not_before)) if not_before is not None else self.start
+        seg_end = list(self.times[1:]) + [self.end]
+
+        best = None
+        for car in (cars or [None]):
+            if car is not None and car not in self.cars.columns: continue
+            free = ok & (self.cars[car] >= 1) if car is not None else ok
+            run_start = None
+            for t0, t1, f in zip(self.times, seg_end, free.to_numpy()):
+                if not f or t1 <= not_before:
+                    run_start = None
+                    continue
+                if run_start is None: run_start = max(t0, not_before)
+                if t1 - run_start >= duration:
+                    if best is None or run_start < best[1]: best = (car, run_start, run_start + duration)
+                    break
+        return best
+
+
+def end_time_view(df_book):
+    """df_book indexed and sorted by End_Time, so return-due windows are binary-search slices."""
+    return df_book.set_index('End_Time', drop=False).rename_axis(None).sort_index()
+
+
+def ending_between(view, start, end):
+    # Bookings with start <= End_Time < end
+    lo, hi = view.index.searchsorted(pd.Timestamp(start)), view.index.searchsorted(pd.Timestamp(end))
+    return view.iloc[lo:hi]
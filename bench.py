@@ -0,0 +1,186 @@
+"""Benchmarks for NavGo hot paths on a synthetic CarBookingDB, no Google Sheet needed.
+
+    python bench.py                                  # 10k / 100k bookings, 50 items
+    python bench.py --bookings 1000000 --items 500 --out bench.jsonl
+
+Each result is one JSON line (bench, sizes, min/median ms, git revision), appended to
+--out when given, so runs from different versions can be compared line by line.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from availability import (BookingIndex, build_equipment_table, cargo_load, end_time_view, ending_between,
+                          equipment_usage, fitting_cars, stock_status, stock_volumes)
+from allocation import TripPlan, allocate_trips
+from importer import normalize_rows, validate_bookings
+from model import BookingModel
+from rollups import RollupStore
+from storage import BOOKING_COLUMNS, car_specs, default_cars, find_booking_conflicts, new_booking_id, prepare_bookings, sheet_rows
+
+# Default fleet from the Cars sheet
+CAR_SPECS = car_specs(default_cars())
+COMPANY_CARS = [c for c, specs in CAR_SPECS.items() if specs['type'] == 'company']
+
+
+def synthetic_db(n_bookings, n_items=50, n_users=40, days=365, seed=0, end=None):
+    """(raw bookings, stock, users) shaped like the CarBookingDB sheets' get_all_records().
+
+    Bookings are spread over `days` before `end`, last 1-72 hours, and carry 0-4
+    "Item xN" entries; times are sheet-style strings so load post-processing is exercised.
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or datetime(2030, 1, 1))
+    items = [f"Item {i:03d}" for i in range(n_items)]
+    df_stock = pd.DataFrame({"ItemName": items, "TotalQty": rng.integers(1, 20, n_items),
+                             "VolumeScore": rng.integers(10, 300, n_items), "Description": ""})
+    users = [f"User {i:03d}" for i in range(n_users)]
+    df_users = pd.DataFrame({"Name": users, "Department": [f"Dept {i % 6}" for i in range(n_users)]})
+
+    start = end - pd.to_timedelta(rng.integers(0, days * 24, n_bookings), unit='h')
+    stop = start + pd.to_timedelta(rng.integers(1, 73, n_bookings), unit='h')
+    cars = np.array(list(CAR_SPECS))[rng.integers(0, len(CAR_SPECS), n_bookings)]
+    n_equip = rng.integers(0, 5, n_bookings)
+    picks = rng.integers(0, n_items, n_equip.sum())
+    qtys = rng.integers(1, 4, n_equip.sum())
+    parts = pd.Series([f"{items[i]} x{q}" for i, q in zip(picks, qtys)])
+    owner = np.repeat(np.arange(n_bookings), n_equip)
+    equipment = parts.groupby(owner).agg(", ".join).reindex(range(n_bookings), fill_value="-")
+
+    df_book = pd.DataFrame({
+        "User": np.array(users)[rng.integers(0, n_users, n_bookings)],
+        "Task": "bench", "Car": cars, "People": rng.integers(1, 8, n_bookings),
+        "Equipment": equipment.to_numpy(), "Location": "site",
+        "Start_Time": start.strftime('%Y-%m-%d %H:%M:%S'), "End_Time": stop.strftime('%Y-%m-%d %H:%M:%S'),
+        "BookingID": [new_booking_id() for _ in range(n_bookings)],
+    })
+    return df_book[BOOKING_COLUMNS], df_stock, df_users
+
+
+def timed(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000)
+    return min(runs), statistics.median(runs)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(n_bookings, n_items, repeat=5, seed=0):
+    raw, df_stock, _ = synthetic_db(n_bookings, n_items, seed=seed)
+    df_book = prepare_bookings(raw.copy())
+    book_idx = BookingIndex.from_frame(df_book)
+    equip_table = build_equipment_table(df_book)
+    df_cars = default_cars()
+    model = BookingModel(df_book, df_stock, df_cars, equip_table)
+    stock_totals = {row['ItemName']: int(row['TotalQty']) for _, row in df_stock.iterrows()}
+
+    # A "now" in the busy part of the history and a typical 4 hour booking window
+    now = df_book['Start_Time'].quantile(0.9)
+    s, e = now.floor('h') + pd.Timedelta(hours=1), now.floor('h') + pd.Timedelta(hours=5)
+    selected = dict(zip(df_stock['ItemName'].head(3), [1, 2, 1]))
+    target = df_book.iloc[len(df_book) // 2].to_dict()
+
+    # A dispatcher's week: 50 trips starting at `now`
+    week, _, _ = synthetic_db(50, n_items, days=7, seed=seed + 1, end=now + pd.Timedelta(days=7))
+    trips = prepare_bookings(week)[['People', 'Equipment', 'Start_Time', 'End_Time']].reset_index(drop=True)
+    upload = normalize_rows(week.drop(columns='BookingID').astype(str))
+
+    def tab1_overlap():
+        overlap_now = df_book.loc[book_idx.overlapping(s, e)]
+        used_now = equipment_usage(equip_table, overlap_now.index)
+        return [max(0, total - int(used_now.get(k, 0))) for k, total in stock_totals.items()]
+
+    benches = {
+        "load_post_process": lambda: prepare_bookings(raw.copy()),
+        "build_booking_index": lambda: BookingIndex.from_frame(df_book),
+        # What the app does per commit instead of a rebuild
+        "apply_commit_to_index": lambda: book_idx.copy().add(-1, df_book['Car'].iat[0], s, e),
+        "build_equipment_table": lambda: build_equipment_table(df_book),
+        "get_stock_status": lambda: stock_status(df_stock, equip_table, book_idx.active_at(now)),
+        "tab1_overlap_usage": tab1_overlap,
+        "valid_cars": lambda: fitting_cars(CAR_SPECS, 3, cargo_load(df_stock, selected), book_idx.busy_cars(s, e)),
+        # The same page work on the compact model the app now uses
+        "build_booking_model": lambda: BookingModel(df_book, df_stock, df_cars, equip_table),
+        "model_stock_status": lambda: model.stock_status(model.active_at(now)),
+        "model_tab1_overlap_usage": lambda: model.available(model.overlapping(s, e)),
+        "model_valid_cars": lambda: fitting_cars(model.specs, 3, model.cargo_load(selected), model.busy_cars(s, e)),
+        "tab3_conflict_check": lambda: find_booking_conflicts(df_book, dict(target, Start_Time=s, End_Time=e), set(COMPANY_CARS),
+                                                              stock_totals, book_idx, equip_table),
+        "allocate_50_trips": lambda: allocate_trips(trips, CAR_SPECS, TripPlan(book_idx, equip_table, stock_totals, COMPANY_CARS),
+                                                    stock_volumes(df_stock)),
+        "import_validate_50_rows": lambda: validate_bookings(upload, df_book, CAR_SPECS, df_stock, equip_table),
+        "due_today": lambda: ending_between(end_time_view(df_book), now.floor('D'), now.floor('D') + pd.Timedelta(days=1)),
+        "save_booking_serialize": lambda: sheet_rows(df_book),
+    }
+    # Rollups live in SQLite: rebuild once, then time one incremental edit and a 90-day analytics read
+    tmp = tempfile.TemporaryDirectory()
+    rollups = RollupStore(f"{tmp.name}/rollups.db")
+    rollups.rebuild(df_book, 0)
+    edited = dict(target, End_Time=target['End_Time'] + pd.Timedelta(hours=2))
+    flip = iter(range(10 ** 9))
+
+    def rollup_edit():
+        rev = next(flip)
+        old, new = (target, edited) if rev % 2 == 0 else (edited, target)
+        rollups.apply(rev, rev + 1, [old], [new])
+
+    def analytics_90_days():
+        rollups.daily((now - pd.Timedelta(days=90)).date(), now.date())
+        rollups.item_peaks((now - pd.Timedelta(days=90)).floor('D'), now.floor('D'))
+
+    benches["rollup_rebuild"] = lambda: RollupStore(f"{tmp.name}/rebuild.db").rebuild(df_book, 0)
+    benches["rollup_apply_edit"] = rollup_edit
+    benches["analytics_90_days"] = analytics_90_days
+
+    for name, fn in benches.items():
+        best, median = timed(fn, repeat)
+        yield {"bench": name, "bookings": len(df_book), "items": n_items, "repeat": repeat,
+               "min_ms": round(best, 3), "median_ms": round(median, 3)}
+    tmp.cleanup()
+
+    # Resident size of what each rerun reads: the generic frames vs the compact model
+    yield {"bench": "memory", "bookings": len(df_book), "items": n_items,
+           "df_book_bytes": int(df_book.memory_usage(deep=True).sum()), "equip_table_bytes": int(equip_table.memory_usage(deep=True).sum()),
+           "model_bytes": model.nbytes()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NavGo hot-path benchmarks on synthetic data")
+    parser.add_argument("--bookings", default="10000,100000", help="comma separated booking counts")
+    parser.add_argument("--items", type=int, default=50, help="StockMaster items")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="append JSON lines here as well as printing them")
+    args = parser.parse_args(argv)
+
+    meta = {"revision": git_revision(), "python": platform.python_version(), "pandas": pd.__version__,
+            "run_at": datetime.now().isoformat(timespec='seconds')}
+    out = open(args.out, "a", encoding="utf-8") if args.out else None
+    try:
+        for n in [int(x) for x in args.bookings.split(",") if x.strip()]:
+            for result in run_suite(n, args.items, args.repeat, args.seed):
+                line = json.dumps(dict(result, **meta), ensure_ascii=False)
+                print(line, flush=True)
+                if out: out.write(line + "\n")
+    finally:
+        if out: out.close()
+
+
+if __name__ == "__main__":
+    main()
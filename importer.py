@@ -0,0 +1,118 @@
+"""Bulk booking import for NavGo: read a CSV/XLSX, validate every row at once, report per row."""
+import pandas as pd
+
+from availability import build_equipment_table, peak_usage, stock_volumes
+
+IMPORT_COLUMNS = ["User", "Task", "Car", "People", "Equipment", "Location", "Start_Time", "End_Time"]
+REQUIRED_COLUMNS = ["User", "Car", "Start_Time", "End_Time"]
+
+
+def read_bookings_file(f, name=None):
+    """CSV or Excel (first sheet) -> raw frame of strings; raises ValueError for unusable files."""
+    name = (name or getattr(f, "name", "")).lower()
+    df = pd.read_excel(f, dtype=str) if name.endswith((".xlsx", ".xls")) else pd.read_csv(f, dtype=str, encoding="utf-8-sig")
+    df.columns = [str(c).strip() for c in df.columns]
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing: raise ValueError(f"ไม่พบคอลัมน์: {', '.join(missing)}")
+    df = df.dropna(how="all").reset_index(drop=True)
+    for col in IMPORT_COLUMNS:
+        if col not in df.columns: df[col] = ""
+    return df[IMPORT_COLUMNS]
+
+
+def normalize_rows(raw):
+    """Typed rows: Timestamps (NaT if unreadable), People as float (NaN if not a number), stripped text."""
+    df = raw.copy()
+    for col in ["User", "Task", "Car", "Location", "Equipment"]:
+        df[col] = df[col].fillna("").astype(str).str.strip()
+    df.loc[df['Equipment'] == "", 'Equipment'] = "-"
+    # read_csv/read_excel(dtype=str) give NaN for blank cells: blank means one person
+    people = df['People'].fillna("").astype(str).str.strip()
+    df['People'] = pd.to_numeric(people.replace("", "1"), errors='coerce')
+    df['Start_Time'] = pd.to_datetime(df['Start_Time'], errors='coerce')
+    df['End_Time'] = pd.to_datetime(df['End_Time'], errors='coerce')
+    return df
+
+
+def _join_by_row(messages, index):
+    # Series of messages labelled by row -> one ", "-joined string per row
+    if messages.empty: return pd.Series("", index=index)
+    return messages.groupby(level=0).agg(", ".join).reindex(index, fill_value="")
+
+
+def validate_bookings(rows, df_book, car_specs, df_stock, equip_table=None):
+    """Per-row problems for adding every row of `rows` (normalized) next to `df_book`.
+
+    Static checks (times, car, seats, cargo, unknown items) are column operations. Rows
+    that pass them are then swept together with the stored bookings in one pass: a
+    company car or item is over-allocated when its peak concurrent use in the row's
+    window, other rows of the file included, exceeds 1 car / StockMaster.TotalQty.
+    Returns `rows` with Errors ("" when fine) and OK columns.
+    """
+    specs = pd.DataFrame.from_dict(car_specs, orient='index')
+    stock_totals = df_stock.drop_duplicates('ItemName', keep='last').set_index('ItemName')['TotalQty'].astype('int64') \
+        if not df_stock.empty else pd.Series(dtype='int64')
+    checks = []
+
+    bad_time = rows['Start_Time'].isna() | rows['End_Time'].isna() | ~(rows['Start_Time'] < rows['End_Time'])
+    checks.append(pd.Series("เวลาไม่ถูกต้อง", index=rows.index[bad_time]))
+    known_car = rows['Car'].isin(specs.index)
+    checks.append(("ไม่พบรถ " + rows['Car'][~known_car]))
+    checks.append(pd.Series("จำนวนคนไม่ถูกต้อง", index=rows.index[rows['People'].isna() | (rows['People'] < 0)]))
+
+    equip = build_equipment_table(rows)
+    unknown = equip[~equip['ItemName'].isin(stock_totals.index)]
+    checks.append("ไม่พบอุปกรณ์ " + unknown['ItemName'])
+    volume = pd.Series(stock_volumes(df_stock), dtype='float64')
+    load = (equip['Qty'] * equip['ItemName'].map(volume).fillna(0)).groupby(level=0).sum().reindex(rows.index, fill_value=0)
+
+    car = specs.reindex(rows['Car'].where(known_car)).set_index(rows.index)
+    seats = known_car & (rows['People'] > car['max_seats'])
+    checks.append(pd.Series("ที่นั่งไม่พอ", index=rows.index[seats]))
+    cargo = known_car & ~seats & (load > car['cargo_score'] - car['cargo_per_person'] * rows['People'])
+    checks.append(("ของเกินพื้นที่รถ (" + load[cargo].round().astype('int64').astype(str) + ")"))
+
+    errors = _join_by_row(pd.concat(checks), rows.index)
+
+    # --- Sweep: stored bookings in the file's window + rows that passed the static checks ---
+    ok = rows[errors == ""]
+    if not ok.empty:
+        company = list(specs.index[specs['type'] == 'company'])
+        lo, hi = ok['Start_Time'].min(), ok['End_Time'].max()
+        if equip_table is None: equip_table = build_equipment_table(df_book)
+        live = df_book[(df_book['Start_Time'] < hi) & (df_book['End_Time'] > lo)] if not df_book.empty else df_book
+        live_equip = equip_table[equip_table.index.isin(live.index)]
+        ok_equip = equip[equip.index.isin(ok.index)]
+
+        def holds(frame, equip_rows, prefix_rows):
+            cars = frame[frame['Car'].isin(company)]
+            car_use = pd.DataFrame({'Row': prefix_rows(cars.index), 'Res': "car:" + cars['Car'], 'Qty': 1,
+                                    'Start_Time': cars['Start_Time'], 'End_Time': cars['End_Time']})
+            item_use = pd.DataFrame({'Row': prefix_rows(equip_rows.index), 'Res': "item:" + equip_rows['ItemName'], 'Qty': equip_rows['Qty'],
+                                     'Start_Time': frame['Start_Time'].reindex(equip_rows.index).to_numpy(),
+                                     'End_Time': frame['End_Time'].reindex(equip_rows.index).to_numpy()})
+            return pd.concat([car_use, item_use], ignore_index=True)
+
+        mine = holds(ok, ok_equip, lambda idx: idx)
+        usage = pd.concat([holds(live, live_equip, lambda idx: [None] * len(idx)), mine], ignore_index=True)
+        usage = usage[usage['Res'].str.startswith("car:") | usage['Res'].str[5:].isin(stock_totals.index)]
+        mine = mine[mine['Res'].isin(usage['Res'])]
+        mine = mine.assign(Peak=peak_usage(usage, mine))
+        limit = mine['Res'].str[5:].map(stock_totals).where(~mine['Res'].str.startswith("car:"), 1).astype('int64')
+        over = mine.assign(Limit=limit)
+        over = over[over['Peak'] > over['Limit']]
+        msg = pd.Series(
+            [f"รถ {r[4:]} ไม่ว่างช่วงนี้" if r.startswith("car:") else f"{r[5:]} เกินจำนวน (ใช้พร้อมกัน {p}/{lim})"
+             for r, p, lim in zip(over['Res'], over['Peak'], over['Limit'])], index=over['Row'].to_numpy(), dtype=object)
+        errors = _join_by_row(pd.concat([pd.Series(errors[errors != ""]), msg]), rows.index) if not msg.empty else errors
+
+    return rows.assign(Errors=errors, OK=errors == "")
+
+
+def import_conflicts(car_specs, df_stock):
+    """A commit_bookings `check`: re-run the sweep against the latest stored bookings."""
+    def check(latest, rows, book_idx, equip_table):
+        report = validate_bookings(normalize_rows(pd.DataFrame(rows)[IMPORT_COLUMNS].astype(object)), latest, car_specs, df_stock, equip_table)
+        bad = report[~report['OK']]
+        return [f"รายการที่ {i + 1}: {e}" for i, e in zip(bad.index, bad['Errors'])]
+    return check
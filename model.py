@@ -0,0 +1,114 @@
+"""Compact, integer-coded booking model for NavGo, built once per loaded data version.
+
+Cars, users and items become int codes into small name arrays, times int64 epoch ns,
+and equipment three flat arrays (booking position, item code, qty), so window queries
+are binary searches plus numpy masks and usage is one bincount into a dense per-item
+quantity array. Results are positions into df_book (use .iloc) or plain dicts.
+"""
+import numpy as np
+import pandas as pd
+
+from availability import LONG_SPAN_NS, build_equipment_table
+from storage import car_specs
+
+
+def _codes(values):
+    # (int32 codes, names) in order of first appearance
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).astype(str))
+    return codes.astype(np.int32), np.asarray(uniques, dtype=object)
+
+
+class BookingModel:
+    """Typed arrays and lookups over one (df_book, df_stock, df_cars) snapshot; read-only once built.
+
+    equip_table: build_equipment_table(df_book) when the caller already has it.
+    """
+
+    def __init__(self, df_book, df_stock, df_cars, equip_table=None):
+        self.specs = car_specs(df_cars)
+        self.car_pos = {c: i for i, c in enumerate(self.specs)}
+        self.company_cars = [c for c, s in self.specs.items() if s['type'] == 'company']
+
+        # Stock: totals last row wins (stock_status), volumes first row wins (stock_volumes)
+        stock = df_stock if not df_stock.empty else pd.DataFrame(columns=['ItemName', 'TotalQty', 'VolumeScore'])
+        self.stock_items = list(dict.fromkeys(stock['ItemName'].astype(str)))
+        self.stock_totals = dict(zip(stock['ItemName'].astype(str), stock['TotalQty'].astype('int64').tolist()))
+        self.volumes = dict(zip(stock['ItemName'].astype(str)[::-1], pd.to_numeric(stock['VolumeScore'], errors='coerce').fillna(0)[::-1].tolist()))
+
+        n = len(df_book)
+        self.n = n
+        self.labels = df_book.index.to_numpy()
+        self.car_code, self.cars = _codes(df_book['Car'] if n else [])
+        self.user_code, self.users = _codes(df_book['User'] if n else [])
+        self.start_ns = df_book['Start_Time'].to_numpy('datetime64[ns]').view('int64') if n else np.array([], dtype='int64')
+        self.end_ns = df_book['End_Time'].to_numpy('datetime64[ns]').view('int64') if n else np.array([], dtype='int64')
+
+        # Equipment: stock items first so their codes index `totals` directly
+        equip = build_equipment_table(df_book) if equip_table is None else equip_table
+        extra = [i for i in pd.unique(equip['ItemName']) if i not in self.stock_totals]
+        self.items = np.asarray(self.stock_items + extra, dtype=object)
+        self.item_pos = {name: i for i, name in enumerate(self.items)}
+        self.totals = np.array([self.stock_totals[i] for i in self.stock_items] + [0] * len(extra), dtype='int64')
+        self.eq_row = df_book.index.get_indexer(equip.index).astype(np.int32) if n else np.array([], dtype=np.int32)
+        self.eq_item = pd.Index(self.items).get_indexer(equip['ItemName']).astype(np.int32)
+        self.eq_qty = equip['Qty'].to_numpy('int32')
+
+        # Overlap search: short bookings sorted by start (bounded look-back), long ones scanned apart
+        span = self.end_ns - self.start_ns
+        long = span > LONG_SPAN_NS
+        self._long = np.flatnonzero(long)
+        short = np.flatnonzero(~long)
+        self._order = short[np.argsort(self.start_ns[short], kind='stable')]
+        self._sorted_start = self.start_ns[self._order]
+        self._max_span = int(span[short].max()) if len(short) else 0
+
+    def overlapping(self, start, end, closed=False):
+        """Positions of bookings overlapping [start, end); closed=True also counts touching ones."""
+        qs, qe = pd.Timestamp(start).value, pd.Timestamp(end).value
+        lo = np.searchsorted(self._sorted_start, qs - self._max_span, side='left')
+        hi = np.searchsorted(self._sorted_start, qe, side='right' if closed else 'left')
+        cand = self._order[lo:hi]
+        cand = cand[self.end_ns[cand] >= qs] if closed else cand[self.end_ns[cand] > qs]
+        s, e = self.start_ns[self._long], self.end_ns[self._long]
+        far = self._long[(s <= qe) & (e >= qs)] if closed else self._long[(s < qe) & (e > qs)]
+        return np.sort(np.concatenate([cand, far]))
+
+    def active_at(self, t):
+        return self.overlapping(t, t, closed=True)
+
+    def matching(self, pos, car=None, user=None):
+        """Those of positions `pos` booked on `car` and/or by `user` (None = any)."""
+        for codes, names, value in ((self.car_code, self.cars, car), (self.user_code, self.users, user)):
+            if value is None: continue
+            hit = np.flatnonzero(names == value)
+            pos = pos[codes[pos] == hit[0]] if len(hit) else pos[:0]
+        return pos
+
+    def busy_cars(self, start, end):
+        return set(self.cars[np.unique(self.car_code[self.overlapping(start, end)])])
+
+    def usage(self, pos):
+        """Dense quantity out per item code across booking positions `pos`."""
+        picked = np.zeros(self.n, dtype=bool)
+        picked[pos] = True
+        sel = picked[self.eq_row]
+        return np.bincount(self.eq_item[sel], weights=self.eq_qty[sel], minlength=len(self.items)).astype('int64')
+
+    def available(self, pos):
+        """{stock item: units left} with booking positions `pos` out, in StockMaster order."""
+        free = self.totals - self.usage(pos)
+        return {name: max(0, int(free[i])) for i, name in enumerate(self.stock_items)}
+
+    def stock_status(self, pos):
+        # Same frame as availability.stock_status(df_stock, equip_table, keys)
+        used = self.usage(pos)[:len(self.stock_items)]
+        total = self.totals[:len(self.stock_items)]
+        return pd.DataFrame({"Total": total, "Used": used, "Available": total - used}, index=self.stock_items)
+
+    def cargo_load(self, selected_equip):
+        return sum(self.volumes[k] * v for k, v in selected_equip.items() if k in self.volumes)
+
+    def nbytes(self):
+        arrays = [self.labels, self.car_code, self.user_code, self.start_ns, self.end_ns, self.eq_row, self.eq_item, self.eq_qty,
+                  self.totals, self._order, self._sorted_start, self._long]
+        return sum(a.nbytes for a in arrays) + sum(len(str(v)) for v in list(self.cars) + list(self.users) + list(self.items))
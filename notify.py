@@ -0,0 +1,204 @@
+"""Persistent, batched Telegram notification queue for NavGo."""
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import requests
+
+TELEGRAM_MAX_CHARS = 4096
+DIGEST_SEPARATOR = "\n\n━━━━━━━━━━━━━━\n\n"
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0, next_try REAL NOT NULL, sent REAL, error TEXT,
+    claimed_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (sent, next_try);
+"""
+
+
+def telegram_config(settings):
+    # Check secrets location (support both root and nested); None when Telegram is not set up
+    if "telegram_token" in settings:
+        return settings["telegram_token"], settings["telegram_chat_id"]
+    if "telegram" in settings:
+        return settings["telegram"]["telegram_token"], settings["telegram"]["telegram_chat_id"]
+    return None
+
+
+def split_message(text, limit=TELEGRAM_MAX_CHARS):
+    # Break on line boundaries so HTML tags (which never span lines here) stay intact
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current: chunks.append(current)
+            chunks.append(line[:limit])
+            current, line = "", line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current: chunks.append(current)
+    return chunks
+
+
+def build_digests(rows, limit=TELEGRAM_MAX_CHARS):
+    """Pack queued (id, text) rows, in order, into as few Telegram-sized messages as possible.
+
+    Returns [(ids, text)]; a row's id goes with the digest that carries its last part.
+    """
+    digests, ids, current = [], [], ""
+    for row_id, text in rows:
+        for part in split_message(text, limit):
+            candidate = f"{current}{DIGEST_SEPARATOR}{part}" if current else part
+            if len(candidate) > limit:
+                digests.append((ids, current))
+                ids, current = [], part
+            else:
+                current = candidate
+        ids.append(row_id)
+    if current: digests.append((ids, current))
+    return digests
+
+
+class NotificationQueue:
+    """Outbox in a local SQLite file, drained by one background worker thread.
+
+    enqueue() only inserts a row, so callers never wait on Telegram. The worker waits
+    `linger` seconds to coalesce bursts into digests, keeps at least `min_interval`
+    seconds between sends, and retries failures with exponential backoff. Unsent rows
+    survive a restart and are picked up when the next worker starts.
+
+    Several processes may drain one outbox (the app worker, reminders.py): a flush claims
+    its rows for `lease` seconds in one write transaction before sending, so no row goes
+    out twice; rows of a sender that died are picked up again once the lease runs out.
+    """
+
+    def __init__(self, path, token, chat_id, linger=3.0, min_interval=3.0, timeout=10, max_backoff=600, lease=600):
+        self.path = path
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.linger = linger
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.session = requests.Session()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_send = 0.0
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(OUTBOX_SCHEMA)
+            if "claimed_until" not in [r[1] for r in conn.execute("PRAGMA table_info(outbox)")]:
+                conn.execute("ALTER TABLE outbox ADD COLUMN claimed_until REAL NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def enqueue(self, text):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO outbox (text, created, next_try) VALUES (?, ?, ?)", (text, now, now))
+        self._wake.set()
+
+    def pending(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE sent IS NULL").fetchone()[0]
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="telegram-notify", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            delay = self.flush()
+            self._wake.wait(timeout=delay)
+            self._wake.clear()
+
+    def _due(self, conn, now):
+        return conn.execute("SELECT id, text, attempts FROM outbox WHERE sent IS NULL AND next_try <= ? AND claimed_until <= ? ORDER BY id",
+                            (now, now)).fetchall()
+
+    def _claim(self, conn):
+        # Select and lease the due rows in one write transaction: another flusher sees them as taken
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._due(conn, now)
+            if rows:
+                conn.execute(f"UPDATE outbox SET claimed_until = ? WHERE id IN ({','.join('?' * len(rows))})",
+                             [now + self.lease] + [r[0] for r in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def flush(self):
+        """Send everything that is due; returns seconds until the worker should look again."""
+        with closing(self._connect()) as conn:
+            if not self._due(conn, time.time()):
+                nxt = conn.execute("SELECT MIN(MAX(next_try, claimed_until)) FROM outbox WHERE sent IS NULL").fetchone()[0]
+                return max(0.5, nxt - time.time()) if nxt else 60.0
+            # Give a burst (e.g. several bookings confirmed together) a moment to arrive
+            self._stop.wait(self.linger)
+            rows = self._claim(conn)
+            if not rows: return 0.5
+            claimed = [r[0] for r in rows]
+            try:
+                return self._send_rows(conn, rows)
+            finally:
+                # Hand back whatever was not marked sent (a retry keeps its backoff in next_try)
+                conn.execute(f"UPDATE outbox SET claimed_until = 0 WHERE sent IS NULL AND id IN ({','.join('?' * len(claimed))})", claimed)
+
+    def _send_rows(self, conn, rows):
+        attempts = max(r[2] for r in rows)
+        for ids, digest in build_digests([(r[0], r[1]) for r in rows]):
+            wait = self.min_interval - (time.time() - self._last_send)
+            if wait > 0: time.sleep(wait)
+            retry_after, error = self._send(digest)
+            self._last_send = time.time()
+            if not ids: continue
+            marks = ",".join("?" * len(ids))
+            if retry_after is not None:
+                backoff = max(retry_after, min(self.max_backoff, 5 * 2 ** attempts))
+                conn.execute(f"UPDATE outbox SET attempts = attempts + 1, next_try = ?, error = ? WHERE id IN ({marks})",
+                             [time.time() + backoff, error] + ids)
+                return backoff
+            conn.execute(f"UPDATE outbox SET sent = ?, error = ? WHERE id IN ({marks})", [time.time(), error] + ids)
+        conn.execute("DELETE FROM outbox WHERE sent IS NOT NULL AND sent < ?", (time.time() - 7 * 86400,))
+        return 0.0
+
+    def _send(self, text, parse_mode='HTML'):
+        # (None, None) on success, (seconds, error) to retry later, (None, error) when it can never succeed
+        data = {'chat_id': self.chat_id, 'text': text}
+        if parse_mode: data['parse_mode'] = parse_mode
+        try:
+            resp = self.session.post(self.url, data=data, timeout=self.timeout)
+        except requests.RequestException as e:
+            return 5, str(e)
+        if resp.ok: return None, None
+        if resp.status_code == 429:
+            try:
+                return int(resp.json().get("parameters", {}).get("retry_after", 30)), resp.text
+            except ValueError:
+                return 30, resp.text
+        if resp.status_code == 400 and parse_mode:
+            # Usually broken HTML from user input: deliver it as plain text instead
+            return self._send(text, parse_mode=None)
+        if resp.status_code == 400: return None, resp.text
+        # 5xx, or 401/403/404 from a bad token/chat that an admin can still fix: keep retrying
+        return 5, resp.text
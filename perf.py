@@ -0,0 +1,88 @@
+"""Lightweight per-operation timing and Google API call counting for NavGo."""
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class PerfRecorder:
+    """Bounded in-process ring buffer of timed operations.
+
+    measure(op) records wall time, outcome and how many Sheets API requests were made
+    while it was open (count_api_call is hooked into the gspread session). Nested
+    operations each count the calls made inside them. With `log_path`, every event is
+    also appended there as one JSON line, for tracking quota use across restarts.
+    """
+
+    def __init__(self, maxlen=2000, log_path=None):
+        self.log_path = log_path
+        self.api_calls = 0
+        self._events = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self):
+        if not hasattr(self._local, "frames"): self._local.frames = []
+        return self._local.frames
+
+    @contextmanager
+    def measure(self, op):
+        frame = {"api_calls": 0}
+        frames = self._open()
+        frames.append(frame)
+        error = None
+        t0 = time.perf_counter()
+        try:
+            yield frame
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # Streamlit's rerun/stop are BaseExceptions: they end up here as a normal exit
+            ms = (time.perf_counter() - t0) * 1000
+            frames.pop()
+            self.record(op, ms, frame["api_calls"], error)
+
+    def count_api_call(self, response=None, *args, **kwargs):
+        # requests response hook: must hand the response back untouched
+        with self._lock:
+            self.api_calls += 1
+        for frame in self._open():
+            frame["api_calls"] += 1
+        return response
+
+    def record(self, op, ms, api_calls=0, error=None):
+        event = {"ts": time.time(), "op": op, "ms": round(ms, 3), "api_calls": api_calls, "error": error}
+        with self._lock:
+            self._events.append(event)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event) + "\n")
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def summary(self):
+        """One row per op: count, p50/p95/max ms, API calls (total and per call), errors."""
+        df = pd.DataFrame(self.events(), columns=["ts", "op", "ms", "api_calls", "error"])
+        if df.empty:
+            return pd.DataFrame(columns=["count", "p50_ms", "p95_ms", "max_ms", "api_calls", "api_per_call", "errors"])
+        g = df.groupby("op")
+        out = pd.DataFrame({
+            "count": g.size(),
+            "p50_ms": g["ms"].quantile(0.5),
+            "p95_ms": g["ms"].quantile(0.95),
+            "max_ms": g["ms"].max(),
+            "api_calls": g["api_calls"].sum(),
+            "errors": g["error"].count(),
+        })
+        out["api_per_call"] = out["api_calls"] / out["count"]
+        return out[["count", "p50_ms", "p95_ms", "max_ms", "api_calls", "api_per_call", "errors"]].round(1).sort_values("p95_ms", ascending=False)
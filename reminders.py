@@ -0,0 +1,151 @@
+"""Scheduled return reminders for NavGo, runnable outside Streamlit.
+
+    python reminders.py                 # send a digest at every --times window, forever
+    python reminders.py --once          # check once now and exit (e.g. from cron)
+
+Reads the same .streamlit/secrets.toml as the app (storage backend + Telegram).
+Every booking is announced at most once per kind per day; what was sent is kept in
+--state (SQLite).
+"""
+import argparse
+import sqlite3
+import sys
+import time
+import tomllib
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from availability import end_time_view, ending_between
+from notify import NotificationQueue, telegram_config
+from storage import open_backend
+
+REMINDER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notified (
+    BookingID TEXT NOT NULL, kind TEXT NOT NULL, day TEXT NOT NULL, sent REAL NOT NULL,
+    PRIMARY KEY (BookingID, kind, day)
+);
+"""
+
+
+def get_thai_time():
+    return datetime.utcnow() + timedelta(hours=7)
+
+
+def has_equipment(df_book):
+    return ~df_book['Equipment'].astype(str).isin(["-", "", "nan", "{}"])
+
+
+def due_report(view, now, overdue_hours=24):
+    """(due later today, overdue with equipment, equipment out right now) from an End_Time view."""
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    due_today = ending_between(view, now, day_start + timedelta(days=1))
+    overdue = ending_between(view, now - timedelta(hours=overdue_hours), now)
+    overdue = overdue[has_equipment(overdue)]
+    # Same rows as the admin Monitor: started and not yet ended
+    still_running = view.iloc[view.index.searchsorted(now):]
+    out_now = still_running[(still_running['Start_Time'] <= now) & has_equipment(still_running)]
+    return due_today, overdue, out_now
+
+
+def _booking_lines(row):
+    # --- เพิ่มสถานที่ในสรุปรายวัน ---
+    return (
+        f"👤 <b>{row['User']}</b>\n"
+        f"📍 {row['Location']}\n"
+        f"🚗 {row['Car']}\n"
+        f"📦 {row['Equipment']}\n"
+        f"🔴 คืนเวลา: {row['End_Time'].strftime('%H:%M')}\n\n"
+    )
+
+
+def format_due_digest(due_today, overdue, now, out_now=None):
+    if due_today.empty and overdue.empty: return None
+    msg = f"📢 <b>แจ้งเตือนรายการคืนวันนี้ ({now.strftime('%d/%m')})</b>\nมีทั้งหมด {len(due_today)} รายการ\n----------------------------\n"
+    msg += "".join(_booking_lines(row) for _, row in due_today.iterrows())
+    if not overdue.empty:
+        msg += f"⏰ <b>เกินกำหนดคืน {len(overdue)} รายการ</b>\n----------------------------\n"
+        msg += "".join(_booking_lines(row) for _, row in overdue.iterrows())
+    if out_now is not None and not out_now.empty:
+        msg += f"📦 ตอนนี้มีการเบิกอุปกรณ์อยู่ {len(out_now)} รายการ\n\n"
+    return msg + "<i>รบกวนตรวจสอบและคืนของให้ตรงเวลาครับ</i>"
+
+
+class ReminderState:
+    def __init__(self, path):
+        self.path = path
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executescript(REMINDER_SCHEMA)
+
+    def unsent(self, df_book, kind, day):
+        if df_book.empty: return df_book
+        with closing(sqlite3.connect(self.path)) as conn:
+            sent = {r[0] for r in conn.execute("SELECT BookingID FROM notified WHERE kind = ? AND day = ?", (kind, day))}
+        return df_book[~df_book['BookingID'].isin(sent)]
+
+    def mark(self, df_book, kind, day):
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO notified VALUES (?, ?, ?, ?)",
+                             [(bid, kind, day, time.time()) for bid in df_book['BookingID']])
+
+
+def run_window(backend, queue, state, now=None, overdue_hours=24):
+    """Send one digest with everything not yet announced today; returns the number of bookings in it."""
+    now = now or get_thai_time()
+    day = now.strftime('%Y-%m-%d')
+    due_today, overdue, out_now = due_report(end_time_view(backend.read_bookings()), now, overdue_hours)
+    due_today = state.unsent(due_today, 'due', day)
+    overdue = state.unsent(overdue, 'overdue', day)
+    msg = format_due_digest(due_today, overdue, now, out_now)
+    if msg is None: return 0
+    queue.enqueue(msg)
+    state.mark(due_today, 'due', day)
+    state.mark(overdue, 'overdue', day)
+    return len(due_today) + len(overdue)
+
+
+def next_window(now, times):
+    today = [datetime.combine(now.date(), datetime.strptime(t, "%H:%M").time()) for t in times]
+    upcoming = [t for t in today if t > now]
+    return min(upcoming) if upcoming else min(today) + timedelta(days=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NavGo due-today / overdue reminders")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    parser.add_argument("--times", default="08:00,16:00", help="comma separated HH:MM (Thai time) windows")
+    parser.add_argument("--overdue-hours", type=int, default=24)
+    parser.add_argument("--state", default="reminders.db")
+    parser.add_argument("--once", action="store_true")
+    parser.add_argument("--retry", type=float, default=300, help="seconds before retrying a window that failed")
+    args = parser.parse_args(argv)
+
+    with open(args.secrets, "rb") as f:
+        settings = tomllib.load(f)
+    tg = telegram_config(settings)
+    if tg is None: parser.error("telegram_token / telegram_chat_id missing from secrets")
+    backend = open_backend(settings)
+    # Same outbox as the app, so a digest that cannot be delivered yet is retried either way
+    queue = NotificationQueue(settings.get("notify_queue_path", "notify_queue.db"), *tg, linger=0)
+    state = ReminderState(args.state)
+    times = [t.strip() for t in args.times.split(",") if t.strip()]
+
+    failed = False
+    while True:
+        if not args.once:
+            # A failed window is retried soon; marks in --state keep the retry from repeating what went out
+            wake = get_thai_time() + timedelta(seconds=args.retry) if failed else next_window(get_thai_time(), times)
+            time.sleep(max(0, (wake - get_thai_time()).total_seconds()))
+        try:
+            count = run_window(backend, queue, state, overdue_hours=args.overdue_hours)
+            queue.flush()
+            print(f"{get_thai_time():%Y-%m-%d %H:%M} reminders: {count} booking(s), {queue.pending()} message(s) pending")
+            failed = False
+        except Exception as e:
+            # Sheets quota, network or a locked SQLite file: log it and keep the scheduler alive
+            print(f"{get_thai_time():%Y-%m-%d %H:%M} reminders failed: {type(e).__name__}: {e}", file=sys.stderr)
+            failed = True
+        if args.once: return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
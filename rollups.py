@@ -0,0 +1,172 @@
+"""Pre-aggregated utilization rollups for NavGo, kept in a local SQLite file.
+
+Two additive tables, so a saved, edited or deleted booking is applied as a signed delta:
+  rollup_daily  (Day, Kind, Key, Value)  car_hours / car_bookings / user_hours / user_bookings /
+                                          item_qty_hours / item_midnight_qty (held at 00:00) per day
+  item_events   (Time, ItemName, Delta)  +qty when items go out, -qty when they return;
+                                          from the midnight level, these give the exact peak per day
+Both can always be rebuilt from the bookings (hot + archive); the stored bookings
+revision says which state they reflect.
+"""
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from availability import build_equipment_table
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    Day TEXT NOT NULL, Kind TEXT NOT NULL, Key TEXT NOT NULL, Value REAL NOT NULL,
+    PRIMARY KEY (Kind, Day, Key)
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_day ON rollup_daily (Day);
+CREATE TABLE IF NOT EXISTS item_events (
+    Time TEXT NOT NULL, ItemName TEXT NOT NULL, Delta INTEGER NOT NULL,
+    PRIMARY KEY (ItemName, Time)
+);
+CREATE INDEX IF NOT EXISTS idx_item_events_time ON item_events (Time);
+CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value INTEGER);
+"""
+TIME_FMT = '%Y-%m-%d %H:%M:%S'
+
+
+def _by_day(df_book):
+    # One row per (booking, calendar day it touches) with the hours spent in that day
+    if df_book.empty: return pd.DataFrame(columns=['Day', 'Car', 'User', 'Hours', 'AtMidnight'])
+    s, e = df_book['Start_Time'], df_book['End_Time']
+    first = s.dt.floor('D')
+    n_days = ((e - pd.Timedelta(1)).dt.floor('D') - first).dt.days.clip(lower=0) + 1
+    rep = df_book.loc[df_book.index.repeat(n_days)]
+    offset = rep.groupby(level=0).cumcount().to_numpy()
+    day = first.loc[rep.index] + pd.to_timedelta(offset, unit='D')
+    hours = (e.loc[rep.index].clip(upper=day + pd.Timedelta(days=1)) - s.loc[rep.index].clip(lower=day)) / pd.Timedelta(hours=1)
+    return pd.DataFrame({'Day': day.dt.strftime('%Y-%m-%d'), 'Car': rep['Car'].astype(str), 'User': rep['User'].astype(str),
+                         'Hours': hours.clip(lower=0), 'AtMidnight': day >= s.loc[rep.index]}, index=rep.index)
+
+
+def booking_rollup(df_book, sign=1):
+    """(daily, events) contributions of booking rows, multiplied by `sign` (-1 to take them out)."""
+    df_book = pd.DataFrame(df_book).reset_index(drop=True)
+    df_book['Start_Time'], df_book['End_Time'] = pd.to_datetime(df_book['Start_Time']), pd.to_datetime(df_book['End_Time'])
+    df_book = df_book[df_book['Start_Time'] < df_book['End_Time']]
+    days = _by_day(df_book)
+    starts = df_book['Start_Time'].dt.strftime('%Y-%m-%d')
+    parts = [
+        days.groupby(['Day', 'Car'])['Hours'].sum().rename_axis(['Day', 'Key']).reset_index().assign(Kind='car_hours'),
+        days.groupby(['Day', 'User'])['Hours'].sum().rename_axis(['Day', 'Key']).reset_index().assign(Kind='user_hours'),
+        pd.DataFrame({'Day': starts, 'Key': df_book['Car'].astype(str)}).value_counts().rename('Hours').reset_index().assign(Kind='car_bookings'),
+        pd.DataFrame({'Day': starts, 'Key': df_book['User'].astype(str)}).value_counts().rename('Hours').reset_index().assign(Kind='user_bookings'),
+    ]
+    equip = build_equipment_table(df_book)
+    if not equip.empty:
+        held = days[['Day', 'Hours', 'AtMidnight']].join(equip, how='inner')
+        at_midnight = held[held['AtMidnight'].astype(bool)]
+        held = held.assign(Hours=held['Hours'] * held['Qty'])
+        parts.append(held.groupby(['Day', 'ItemName'])['Hours'].sum().rename_axis(['Day', 'Key']).reset_index().assign(Kind='item_qty_hours'))
+        parts.append(at_midnight.groupby(['Day', 'ItemName'])['Qty'].sum().rename('Hours').rename_axis(['Day', 'Key']).reset_index()
+                     .assign(Kind='item_midnight_qty'))
+    daily = pd.concat(parts, ignore_index=True).rename(columns={'Hours': 'Value'})
+    daily = daily.assign(Value=daily['Value'].astype(float) * sign)[['Day', 'Kind', 'Key', 'Value']]
+
+    ev = pd.DataFrame({
+        'Time': pd.concat([df_book['Start_Time'].loc[equip.index], df_book['End_Time'].loc[equip.index]]).dt.strftime(TIME_FMT).to_numpy(),
+        'ItemName': pd.concat([equip['ItemName']] * 2).to_numpy(),
+        'Delta': pd.concat([equip['Qty'], -equip['Qty']]).to_numpy() * sign,
+    })
+    events = ev.groupby(['Time', 'ItemName'], as_index=False)['Delta'].sum()
+    return daily, events
+
+
+class RollupStore:
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(ROLLUP_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def revision(self):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM rollup_meta WHERE key = 'bookings_revision'").fetchone()
+        return row[0] if row else None
+
+    def _write(self, conn, daily, events):
+        conn.executemany("INSERT INTO rollup_daily VALUES (?, ?, ?, ?) ON CONFLICT (Kind, Day, Key) DO UPDATE SET Value = Value + excluded.Value",
+                         daily.itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO item_events VALUES (?, ?, ?) ON CONFLICT (ItemName, Time) DO UPDATE SET Delta = Delta + excluded.Delta",
+                         [(t, i, int(d)) for t, i, d in events.itertuples(index=False, name=None)])
+        # Drop what cancelled out, looking only at the keys just touched
+        conn.executemany("DELETE FROM rollup_daily WHERE Kind = ? AND Day = ? AND Key = ? AND abs(Value) < 1e-9",
+                         daily[['Kind', 'Day', 'Key']].itertuples(index=False, name=None))
+        conn.executemany("DELETE FROM item_events WHERE ItemName = ? AND Time = ? AND Delta = 0",
+                         events[['ItemName', 'Time']].itertuples(index=False, name=None))
+
+    def _set_revision(self, conn, rev):
+        conn.execute("INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('bookings_revision', ?)", (rev,))
+
+    def apply(self, base_rev, new_rev, removed=None, added=None):
+        """Move the rollups from bookings revision base_rev to new_rev by taking `removed` rows
+        out and putting `added` rows in. Returns False (nothing written) unless the rollups are
+        exactly at base_rev and new_rev is the very next revision, i.e. nobody else wrote between.
+        """
+        if base_rev is None or new_rev != base_rev + 1: return False
+        deltas = [booking_rollup(rows, sign) for rows, sign in ((removed, -1), (added, 1)) if rows is not None and len(rows)]
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM rollup_meta WHERE key = 'bookings_revision'").fetchone()
+            if row is None or row[0] != base_rev:
+                conn.execute("ROLLBACK")
+                return False
+            for daily, events in deltas:
+                self._write(conn, daily, events)
+            self._set_revision(conn, new_rev)
+            conn.execute("COMMIT")
+        return True
+
+    def rebuild(self, df_all, rev):
+        """Recompute everything from the full booking history (hot + archive) at revision `rev`."""
+        daily, events = booking_rollup(df_all)
+        daily = daily.groupby(['Day', 'Kind', 'Key'], as_index=False)['Value'].sum()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM rollup_daily")
+            conn.execute("DELETE FROM item_events")
+            self._write(conn, daily, events)
+            self._set_revision(conn, rev)
+            conn.execute("COMMIT")
+
+    def daily(self, start, end, kinds=None):
+        """rollup_daily rows with start <= Day < end (dates), optionally only some kinds."""
+        sql, params = "SELECT Day, Kind, Key, Value FROM rollup_daily WHERE Day >= ? AND Day < ?", [str(start), str(end)]
+        if kinds:
+            sql += f" AND Kind IN ({', '.join('?' * len(kinds))})"
+            params += list(kinds)
+        with closing(self._connect()) as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        df['Day'] = pd.to_datetime(df['Day'])
+        return df
+
+    def item_peaks(self, start, end):
+        """Highest quantity out at any moment of each day in [start, end) (whole days), per ItemName."""
+        start, end = pd.Timestamp(start).floor('D'), pd.Timestamp(end)
+        days = pd.date_range(start, end - pd.Timedelta(1), freq='D')
+        opening = self.daily(start.date(), days[-1].date() + pd.Timedelta(days=1), kinds=['item_midnight_qty']) if len(days) else None
+        with closing(self._connect()) as conn:
+            ev = pd.read_sql_query("SELECT Time, ItemName, Delta FROM item_events WHERE Time >= ? AND Time < ?",
+                                   conn, params=(start.strftime(TIME_FMT), (days[-1] + pd.Timedelta(days=1)).strftime(TIME_FMT) if len(days) else ""))
+        if not len(days) or (opening.empty and ev.empty): return pd.DataFrame(index=days, dtype='int64')
+        # Level at midnight, then the running level after each change during that day
+        opening = opening.rename(columns={'Key': 'ItemName', 'Value': 'Level'})[['Day', 'ItemName', 'Level']]
+        ev['Time'] = pd.to_datetime(ev['Time'])
+        ev['Day'] = ev['Time'].dt.floor('D')
+        # Changes at exactly 00:00 are already part of that day's midnight level
+        ev = ev[ev['Time'] > ev['Day']].sort_values(['ItemName', 'Time'])
+        ev['Level'] = ev.groupby(['ItemName', 'Day'])['Delta'].cumsum()
+        ev = ev.merge(opening, on=['Day', 'ItemName'], how='left', suffixes=('', '_open'))
+        ev['Level'] += ev['Level_open'].fillna(0)
+        levels = pd.concat([opening, ev[['Day', 'ItemName', 'Level']]], ignore_index=True)
+        peaks = levels.pivot_table(index='Day', columns='ItemName', values='Level', aggfunc='max')
+        return peaks.reindex(days).fillna(0).clip(lower=0).astype('int64').rename_axis(index=None, columns=None)
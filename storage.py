@@ -0,0 +1,701 @@
+"""Storage backends for NavGo (Google Sheets, SQLite, in-memory) and the optimistic booking commit."""
+import sqlite3
+import threading
+import uuid
+from contextlib import closing
+from datetime import datetime
+
+import gspread
+import pandas as pd
+from oauth2client.service_account import ServiceAccountCredentials
+
+from allocation import TripPlan
+from availability import BookingIndex, build_equipment_table, equipment_usage, parse_equip_str
+
+BOOKING_COLUMNS = ["User", "Task", "Car", "People", "Equipment", "Location", "Start_Time", "End_Time", "BookingID"]
+STOCK_COLUMNS = ["ItemName", "TotalQty", "VolumeScore", "Description"]
+USER_COLUMNS = ["Name", "Department"]
+# CargoPerPerson: cargo room each passenger takes (0 when people and load don't share space, e.g. a pickup bed)
+CAR_COLUMNS = ["CarName", "MaxSeats", "CargoScore", "CargoPerPerson", "Type"]
+DEFAULT_CARS = [
+    ["Honda Jazz 2019", 5, 1500, 20, "company"],
+    ["Isuzu Mu-X", 7, 1800, 20, "company"],
+    ["Isuzu D-max 4 Doors", 5, 2200, 0, "company"],
+    ["🚙 รถส่วนตัว (เบิกค่าน้ำมัน)", 99, 9999, 0, "private"],
+    ["📦 ไม่ใช้รถ (ยืมเฉพาะของ)", 99, 9999, 0, "no_car"],
+]
+META_SHEET = "Meta"
+ARCHIVE_PREFIX = "Archive_"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    BookingID TEXT PRIMARY KEY, User TEXT, Task TEXT, Car TEXT, People INTEGER,
+    Equipment TEXT, Location TEXT, Start_Time TEXT NOT NULL, End_Time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_car_time ON bookings (Car, Start_Time, End_Time);
+CREATE INDEX IF NOT EXISTS idx_bookings_time ON bookings (Start_Time, End_Time);
+CREATE TABLE IF NOT EXISTS bookings_archive (
+    BookingID TEXT PRIMARY KEY, User TEXT, Task TEXT, Car TEXT, People INTEGER,
+    Equipment TEXT, Location TEXT, Start_Time TEXT NOT NULL, End_Time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archive_time ON bookings_archive (Start_Time, End_Time);
+CREATE TABLE IF NOT EXISTS stock (ItemName TEXT, TotalQty INTEGER, VolumeScore REAL, Description TEXT);
+CREATE TABLE IF NOT EXISTS users (Name TEXT, Department TEXT);
+CREATE TABLE IF NOT EXISTS cars (CarName TEXT, MaxSeats INTEGER, CargoScore REAL, CargoPerPerson REAL, Type TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+"""
+
+
+def new_booking_id():
+    # Letter prefix so no spreadsheet can read an id as a number ('1e4298259505' -> inf, '0123' -> 123)
+    return "B" + uuid.uuid4().hex[:11]
+
+
+def empty_bookings():
+    # Same dtypes as prepare_bookings output, so concatenating typed rows onto it stays datetime
+    return pd.DataFrame(columns=BOOKING_COLUMNS).astype({'People': 'int64', 'Start_Time': 'datetime64[us]', 'End_Time': 'datetime64[us]'})
+
+
+def default_cars():
+    return pd.DataFrame(DEFAULT_CARS, columns=CAR_COLUMNS)
+
+
+def car_specs(df_cars):
+    """Cars sheet -> {name: {max_seats, cargo_score, cargo_per_person, type}} in sheet order."""
+    specs = {}
+    for row in df_cars.to_dict('records'):
+        name = str(row.get('CarName', '')).strip()
+        if not name: continue
+        specs[name] = {"max_seats": int(row['MaxSeats']), "cargo_score": float(row['CargoScore']),
+                       "cargo_per_person": float(row.get('CargoPerPerson') or 0), "type": str(row['Type']).strip()}
+    return specs
+
+
+def prepare_bookings(df_book):
+    # Raw sheet records -> typed frame used by every page
+    if df_book.empty: return empty_bookings()
+    df_book['BookingID'] = df_book['BookingID'].astype(str)
+    df_book['Start_Time'] = pd.to_datetime(df_book['Start_Time'].astype(str), errors='coerce')
+    df_book['End_Time'] = pd.to_datetime(df_book['End_Time'].astype(str), errors='coerce')
+    df_book = df_book.dropna(subset=['Start_Time', 'End_Time'])
+    if 'Car' in df_book.columns: df_book['Car'] = df_book['Car'].astype(str).str.strip()
+    if 'Equipment' in df_book.columns: df_book['Equipment'] = df_book['Equipment'].astype(str)
+    return df_book
+
+
+def with_archive(archive, df_book):
+    # Hot and archived bookings together. An interrupted archive run can leave a booking in both;
+    # the hot row is the live one
+    if archive.empty: return df_book
+    archive = archive[~archive['BookingID'].isin(df_book['BookingID'])]
+    return pd.concat([archive, df_book], ignore_index=True) if not df_book.empty else archive
+
+
+def apply_changes(df_book, changes, rows_by_id=None):
+    """df_book with committed (op, row) changes applied in memory, as storage would now return it.
+
+    Edits keep their label, adds get new ones after the last. Returns (df, dropped labels,
+    typed frame of the added/edited rows), or None when an edited/cancelled row is not in df_book.
+    """
+    if rows_by_id is None: rows_by_id = dict(zip(df_book['BookingID'], df_book.index))
+    drop, cancelled, new_rows, new_labels = [], [], [], []
+    next_label = int(df_book.index.max()) + 1 if len(df_book) else 0
+    for op, row in changes:
+        label = None
+        if op != 'add':
+            label = rows_by_id.get(row['BookingID'])
+            if label is None: return None
+            drop.append(label)
+            if op == 'cancel': cancelled.append(label)
+        if op != 'cancel':
+            if label is None: label, next_label = next_label, next_label + 1
+            new_rows.append(row)
+            new_labels.append(label)
+    columns = df_book.columns if len(df_book.columns) else BOOKING_COLUMNS
+    new = prepare_bookings(pd.DataFrame(new_rows, index=new_labels)).reindex(columns=columns) if new_rows else df_book.iloc[:0]
+    order = df_book.index.drop(cancelled).append(pd.Index([l for l in new_labels if l not in drop]))
+    rest = df_book.drop(index=drop)
+    # Never concat onto an empty frame: its dtypes would win for the new rows
+    df = (pd.concat([rest, new]) if len(rest) else new).reindex(order)
+    return df, drop, new
+
+
+def _cell_value(v):
+    if isinstance(v, (datetime, pd.Timestamp)): return v.strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(v, 'item'): return v.item()  # numpy scalars are not JSON serializable
+    if v is None or (isinstance(v, float) and pd.isna(v)): return ""
+    return v
+
+
+def sheet_rows(df):
+    # Header + rows exactly as written to a worksheet
+    return [df.columns.values.tolist()] + [[_cell_value(v) for v in r] for r in df.values.tolist()]
+
+
+class BookingConflict(Exception):
+    def __init__(self, reasons):
+        super().__init__("; ".join(reasons))
+        self.reasons = reasons
+
+
+def _booking_gone(booking_id):
+    # Edit/cancel of a row someone else already cancelled or archived
+    return BookingConflict([f"ไม่พบรายการ {booking_id} แล้ว (อาจถูกยกเลิกหรือย้ายไปเก็บถาวร)"])
+
+
+def authorize_client(creds_dict, on_response=None):
+    # on_response: requests hook called once per Sheets/Drive API response (e.g. call counting)
+    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(creds_dict), scope)
+    client = gspread.authorize(creds)
+    session = getattr(getattr(client, 'http_client', None), 'session', None)
+    if on_response is not None and session is not None: session.hooks['response'].append(on_response)
+    return client
+
+
+def open_backend(settings, sh=None):
+    # settings: st.secrets or the parsed secrets.toml; storage_backend = "sheets" | "sqlite"
+    if settings.get("storage_backend", "sheets") == "sqlite":
+        return SQLiteBackend(settings.get("sqlite_path", "navgo.db"))
+    if sh is None: sh = authorize_client(settings["gcp_service_account"]).open("CarBookingDB")
+    return SheetsBackend(sh)
+
+
+def _overlapping(df_book, start, end):
+    if start is None or df_book.empty: return df_book
+    return df_book[(df_book['Start_Time'] < end) & (df_book['End_Time'] > start)]
+
+
+class SheetsBackend:
+    """Google Sheets "CarBookingDB": bookings on the first worksheet, StockMaster, Users,
+    and the bookings revision counter in Meta!B1.
+
+    Google Sheets has no compare-and-swap, so write_if() checks the revision right before
+    writing and bumps it right after. Within a process (one backend shared by every session)
+    check, write and bump run under a lock; across processes the race window is one row write.
+    """
+
+    def __init__(self, sh):
+        self.sh = sh
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ws(self):
+        return self.sh.sheet1
+
+    def _worksheet(self, title, header, rows=()):
+        if title not in self._worksheets:
+            try:
+                ws = self.sh.worksheet(title)
+            except gspread.exceptions.WorksheetNotFound:
+                ws = self.sh.add_worksheet(title, 100, len(header))
+                ws.update(values=[header] + [list(r) for r in rows], range_name="A1")
+            self._worksheets[title] = ws
+        return self._worksheets[title]
+
+    def _meta(self):
+        return self._worksheet(META_SHEET, ["bookings_revision", 0])
+
+    def revision(self):
+        value = self._meta().acell("B1").value
+        return int(value) if value not in (None, "") else 0
+
+    def _bump(self, rev):
+        self._meta().update(values=[[rev + 1]], range_name="B1")
+
+    def _backfill_ids(self, df):
+        # Older sheets have no BookingID column: fill it once in place (single column write, no rewrite)
+        header = list(df.columns)
+        if 'BookingID' not in df.columns:
+            df['BookingID'] = ""
+            header = header + ['BookingID']
+        missing = df['BookingID'].astype(str).str.strip() == ""
+        if not missing.any(): return df
+        df.loc[missing, 'BookingID'] = [new_booking_id() for _ in range(int(missing.sum()))]
+        col = header.index('BookingID') + 1
+        if col > self.ws.col_count: self.ws.add_cols(col - self.ws.col_count)
+        rng = f"{gspread.utils.rowcol_to_a1(1, col)}:{gspread.utils.rowcol_to_a1(len(df) + 1, col)}"
+        self.ws.update(values=[['BookingID']] + [[v] for v in df['BookingID'].tolist()], range_name=rng)
+        return df
+
+    @staticmethod
+    def _booking_records(ws):
+        # Read every cell as text so BookingIDs survive (gspread would turn hex ids into inf or drop
+        # leading zeros); only People is numeric
+        df = pd.DataFrame(ws.get_all_records(numericise_ignore=['all']))
+        if 'People' in df.columns: df['People'] = pd.to_numeric(df['People'], errors='coerce').fillna(0).astype('int64')
+        return df
+
+    def read_bookings(self, start=None, end=None):
+        # Sheets cannot filter server side: always a full read, then the window is cut locally
+        df = self._booking_records(self.ws)
+        if df.empty: return empty_bookings()
+        return _overlapping(prepare_bookings(self._backfill_ids(df)), start, end)
+
+    def archive_bookings(self, before):
+        """Move bookings that ended before `before` into per-month Archive_YYYY-MM worksheets."""
+        rev = self.revision()
+        df = self.read_bookings()
+        old = df[df['End_Time'] < before]
+        if old.empty: return 0
+        for month, part in old.groupby(old['End_Time'].dt.strftime('%Y-%m')):
+            ws = self._worksheet(f"{ARCHIVE_PREFIX}{month}", BOOKING_COLUMNS)
+            header = ws.row_values(1)
+            ws.append_rows([[_cell_value(r.get(h, "")) for h in header] for r in part.to_dict('records')], table_range="A1")
+        # Archive rows are written first and de-duplicated on read (see with_archive), so an aborted
+        # run loses nothing; then only the archived rows are deleted, never a rewrite of the hot sheet.
+        # Their row numbers come from a fresh read of the BookingID column, not from the read above
+        archived = set(old['BookingID'])
+        with self._lock:
+            if self.revision() != rev: raise BookingConflict(["มีการแก้ไขการจองระหว่างเก็บประวัติ กรุณาลองใหม่"])
+            ids = self.ws.col_values(self._header().index('BookingID') + 1)
+            self._delete_rows([r for r, v in enumerate(ids, start=1) if r > 1 and v in archived])
+            self._bump(rev)
+        return len(old)
+
+    def _delete_rows(self, rows):
+        # One batchUpdate; contiguous runs, bottom-up so each delete leaves the rows above in place
+        runs = []
+        for r in sorted(rows, reverse=True):
+            if runs and runs[-1][0] == r + 1: runs[-1][0] = r
+            else: runs.append([r, r])
+        self.sh.batch_update({"requests": [{"deleteDimension": {"range": {
+            "sheetId": self.ws.id, "dimension": "ROWS", "startIndex": lo - 1, "endIndex": hi}}} for lo, hi in runs]})
+
+    def read_archive(self, start=None, end=None):
+        titles = sorted(ws.title for ws in self.sh.worksheets() if ws.title.startswith(ARCHIVE_PREFIX))
+        if start is not None:
+            # Partitions are by End_Time month; one extra month catches bookings running past `end`
+            lo, hi = pd.Timestamp(start).strftime('%Y-%m'), (pd.Timestamp(end) + pd.DateOffset(months=1)).strftime('%Y-%m')
+            titles = [t for t in titles if lo <= t[len(ARCHIVE_PREFIX):] <= hi]
+        frames = [self._booking_records(self._worksheet(t, BOOKING_COLUMNS)) for t in titles]
+        frames = [f for f in frames if not f.empty]
+        if not frames: return empty_bookings()
+        df = prepare_bookings(pd.concat(frames, ignore_index=True)).drop_duplicates('BookingID', keep='last')
+        return _overlapping(df, start, end)
+
+    def read_stock(self):
+        records = self._worksheet("StockMaster", STOCK_COLUMNS).get_all_records()
+        return pd.DataFrame(records) if records else pd.DataFrame(columns=STOCK_COLUMNS)
+
+    def read_users(self):
+        records = self._worksheet("Users", USER_COLUMNS, [["Admin", "IT"]]).get_all_records()
+        return pd.DataFrame(records) if records else pd.DataFrame(columns=USER_COLUMNS)
+
+    def read_cars(self):
+        records = self._worksheet("Cars", CAR_COLUMNS, DEFAULT_CARS).get_all_records()
+        return pd.DataFrame(records) if records else pd.DataFrame(columns=CAR_COLUMNS)
+
+    def _replace(self, ws, df):
+        # Overwrite from A1, then clear the leftover tail: readers never see an empty sheet
+        rows = sheet_rows(df)
+        ws.update(values=rows, range_name="A1")
+        last_col = gspread.utils.rowcol_to_a1(1, max(ws.col_count, len(rows[0]))).rstrip("1")
+        ws.batch_clear([f"A{len(rows) + 1}:{last_col}"])
+
+    def save_stock(self, df):
+        self._replace(self._worksheet("StockMaster", STOCK_COLUMNS), df)
+
+    def save_users(self, df):
+        self._replace(self._worksheet("Users", USER_COLUMNS), df)
+
+    def save_cars(self, df):
+        self._replace(self._worksheet("Cars", CAR_COLUMNS, DEFAULT_CARS), df)
+
+    def _header(self):
+        header = self.ws.row_values(1)
+        if not header:
+            self.ws.update(values=[BOOKING_COLUMNS], range_name="A1")
+            header = list(BOOKING_COLUMNS)
+        return header
+
+    def _find_row(self, booking_id, header):
+        # Downloads only the BookingID column (ws.find fetches every cell of the sheet)
+        ids = self.ws.col_values(header.index('BookingID') + 1)
+        try:
+            return ids.index(str(booking_id), 1) + 1
+        except ValueError:
+            return None
+
+    def append(self, row):
+        row = dict(row)
+        if not row.get('BookingID'): row['BookingID'] = new_booking_id()
+        self.ws.append_row([_cell_value(row.get(h, "")) for h in self._header()], table_range="A1")
+        return row['BookingID']
+
+    def _locate(self, booking_id, header):
+        # Row of booking_id, confirmed by a one-cell read right before the caller writes to it: if another
+        # process deleted a row above it in between, look it up again instead of writing to a neighbour
+        col = header.index('BookingID') + 1
+        for _ in range(3):
+            r = self._find_row(booking_id, header)
+            if r is None: raise _booking_gone(booking_id)
+            if str(self.ws.cell(r, col).value) == str(booking_id): return r
+        raise BookingConflict(["มีการแก้ไขข้อมูลพร้อมกันหลายรายการ กรุณาลองใหม่"])
+
+    def update(self, booking_id, row):
+        row = dict(row, BookingID=booking_id)
+        header = self._header()
+        r = self._locate(booking_id, header)
+        last = gspread.utils.rowcol_to_a1(r, len(header))
+        self.ws.update(values=[[_cell_value(row.get(h, "")) for h in header]], range_name=f"A{r}:{last}")
+        return booking_id
+
+    def delete(self, booking_id):
+        self.ws.delete_rows(self._locate(booking_id, self._header()))
+        return booking_id
+
+    def write_if(self, expected_rev, op, row):
+        # Returns the booking id, or None when someone else committed first
+        with self._lock:
+            rev = self.revision()
+            if rev != expected_rev: return None
+            if op == 'add': result = self.append(row)
+            elif op == 'edit': result = self.update(row['BookingID'], row)
+            else: result = self.delete(row['BookingID'])
+            self._bump(rev)
+            return result
+
+    def write_many_if(self, expected_rev, rows):
+        # Batch add as one append_rows call; returns the booking ids, or None when someone committed first
+        rows = [dict(r, BookingID=r.get('BookingID') or new_booking_id()) for r in rows]
+        with self._lock:
+            rev = self.revision()
+            if rev != expected_rev: return None
+            header = self._header()
+            self.ws.append_rows([[_cell_value(r.get(h, "")) for h in header] for r in rows], table_range="A1")
+            self._bump(rev)
+            return [r['BookingID'] for r in rows]
+
+    def compact(self, df, expected_rev):
+        # Full rewrite: maintenance only, day-to-day writes go through write_if.
+        # Returns the row count, or None when someone committed after `df` was read
+        with self._lock:
+            rev = self.revision()
+            if rev != expected_rev: return None
+            self._replace(self.ws, df)
+            self._bump(rev)
+            return len(df)
+
+
+class SQLiteBackend:
+    """Local SQLite file in WAL mode. Bookings are indexed on (Car, Start_Time, End_Time) so
+    overlap windows are answered by the database, and write_if() is a real transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('bookings_revision', 0)")
+            if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+                conn.execute("INSERT INTO users (Name, Department) VALUES ('Admin', 'IT')")
+            if conn.execute("SELECT COUNT(*) FROM cars").fetchone()[0] == 0:
+                conn.executemany(f"INSERT INTO cars ({', '.join(CAR_COLUMNS)}) VALUES (?, ?, ?, ?, ?)", DEFAULT_CARS)
+
+    def _connect(self):
+        # One short-lived connection per call keeps it safe across Streamlit session threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def revision(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT value FROM meta WHERE key = 'bookings_revision'").fetchone()[0]
+
+    def read_bookings(self, start=None, end=None):
+        sql, params = f"SELECT {', '.join(BOOKING_COLUMNS)} FROM bookings", ()
+        if start is not None:
+            sql, params = sql + " WHERE Start_Time < ? AND End_Time > ?", (_cell_value(end), _cell_value(start))
+        with closing(self._connect()) as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        return prepare_bookings(df) if not df.empty else empty_bookings()
+
+    def archive_bookings(self, before):
+        """Move bookings that ended before `before` into the bookings_archive table."""
+        cols = ", ".join(BOOKING_COLUMNS)
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"INSERT OR REPLACE INTO bookings_archive ({cols}) SELECT {cols} FROM bookings WHERE End_Time < ?",
+                         (_cell_value(before),))
+            moved = conn.execute("DELETE FROM bookings WHERE End_Time < ?", (_cell_value(before),)).rowcount
+            if moved: conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'bookings_revision'")
+            conn.execute("COMMIT")
+        return moved
+
+    def read_archive(self, start=None, end=None):
+        sql, params = f"SELECT {', '.join(BOOKING_COLUMNS)} FROM bookings_archive", ()
+        if start is not None:
+            sql, params = sql + " WHERE Start_Time < ? AND End_Time > ?", (_cell_value(end), _cell_value(start))
+        with closing(self._connect()) as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        return prepare_bookings(df) if not df.empty else empty_bookings()
+
+    def read_stock(self):
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query("SELECT * FROM stock", conn)
+
+    def read_users(self):
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query("SELECT * FROM users", conn)
+
+    def read_cars(self):
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query("SELECT * FROM cars", conn)
+
+    def _replace_table(self, table, df):
+        # Stock/Users columns are edited freely from the admin page, so the table follows the frame
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"DELETE FROM {table}")
+            existing = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+            for col in df.columns:
+                if col not in existing: conn.execute(f'ALTER TABLE {table} ADD COLUMN "{col}"')
+            cols = ", ".join(f'"{c}"' for c in df.columns)
+            conn.executemany(f"INSERT INTO {table} ({cols}) VALUES ({', '.join('?' * len(df.columns))})",
+                             [[_cell_value(v) for v in r] for r in df.values.tolist()])
+            conn.execute("COMMIT")
+
+    def save_stock(self, df):
+        self._replace_table("stock", df)
+
+    def save_users(self, df):
+        self._replace_table("users", df)
+
+    def save_cars(self, df):
+        self._replace_table("cars", df)
+
+    def _insert(self, conn, rows, replace=False):
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        conn.executemany(f"{verb} INTO bookings ({', '.join(BOOKING_COLUMNS)}) VALUES ({', '.join('?' * len(BOOKING_COLUMNS))})",
+                         [[_cell_value(row.get(c, "")) for c in BOOKING_COLUMNS] for row in rows])
+
+    def write_if(self, expected_rev, op, row):
+        row = dict(row)
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rev = conn.execute("SELECT value FROM meta WHERE key = 'bookings_revision'").fetchone()[0]
+            if rev != expected_rev:
+                conn.execute("ROLLBACK")
+                return None
+            if op == 'add':
+                row['BookingID'] = row.get('BookingID') or new_booking_id()
+                self._insert(conn, [row])
+            elif op == 'edit':
+                if conn.execute("SELECT 1 FROM bookings WHERE BookingID = ?", (row['BookingID'],)).fetchone() is None:
+                    conn.execute("ROLLBACK")
+                    raise _booking_gone(row['BookingID'])
+                self._insert(conn, [row], replace=True)
+            elif conn.execute("DELETE FROM bookings WHERE BookingID = ?", (row['BookingID'],)).rowcount == 0:
+                conn.execute("ROLLBACK")
+                raise _booking_gone(row['BookingID'])
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'bookings_revision'")
+            conn.execute("COMMIT")
+        return row['BookingID']
+
+    def write_many_if(self, expected_rev, rows):
+        rows = [dict(r, BookingID=r.get('BookingID') or new_booking_id()) for r in rows]
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT value FROM meta WHERE key = 'bookings_revision'").fetchone()[0] != expected_rev:
+                conn.execute("ROLLBACK")
+                return None
+            self._insert(conn, rows)
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'bookings_revision'")
+            conn.execute("COMMIT")
+        return [r['BookingID'] for r in rows]
+
+    def compact(self, df, expected_rev):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT value FROM meta WHERE key = 'bookings_revision'").fetchone()[0] != expected_rev:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute("DELETE FROM bookings")
+            self._insert(conn, df.to_dict('records'))
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'bookings_revision'")
+            conn.execute("COMMIT")
+        with closing(self._connect()) as conn:
+            conn.execute("VACUUM")
+        return len(df)
+
+
+class MemoryBackend:
+    """In-process stand-in with a real lock-based compare-and-swap, for offline use and tests."""
+
+    def __init__(self, df_book=None, df_stock=None, df_users=None):
+        self._df = empty_bookings() if df_book is None else df_book.reset_index(drop=True)
+        self._stock = pd.DataFrame(columns=STOCK_COLUMNS) if df_stock is None else df_stock.copy()
+        self._users = pd.DataFrame([{"Name": "Admin", "Department": "IT"}]) if df_users is None else df_users.copy()
+        self._cars = default_cars()
+        self._archive = empty_bookings()
+        self._rev = 0
+        self._lock = threading.Lock()
+
+    def revision(self):
+        return self._rev
+
+    def read_bookings(self, start=None, end=None):
+        with self._lock:
+            df = self._df.copy()
+        return _overlapping(prepare_bookings(df), start, end)
+
+    def archive_bookings(self, before):
+        with self._lock:
+            df = prepare_bookings(self._df.copy())
+            old = df['End_Time'] < before
+            if not old.any(): return 0
+            self._archive = pd.concat([self._archive, df[old]], ignore_index=True)
+            self._df = df[~old].reset_index(drop=True)
+            self._rev += 1
+            return int(old.sum())
+
+    def read_archive(self, start=None, end=None):
+        with self._lock:
+            df = self._archive.copy()
+        return _overlapping(prepare_bookings(df), start, end)
+
+    def read_stock(self):
+        return self._stock.copy()
+
+    def read_users(self):
+        return self._users.copy()
+
+    def read_cars(self):
+        return self._cars.copy()
+
+    def save_stock(self, df):
+        self._stock = df.copy()
+
+    def save_users(self, df):
+        self._users = df.copy()
+
+    def save_cars(self, df):
+        self._cars = df.copy()
+
+    def write_if(self, expected_rev, op, row):
+        with self._lock:
+            if self._rev != expected_rev: return None
+            row = dict(row)
+            if op == 'add':
+                row['BookingID'] = row.get('BookingID') or new_booking_id()
+                self._df = pd.concat([self._df, pd.DataFrame([row])], ignore_index=True)
+            else:
+                hit = self._df['BookingID'] == row['BookingID']
+                if not hit.any(): raise _booking_gone(row['BookingID'])
+                if op == 'edit':
+                    for k, v in row.items(): self._df.loc[hit, k] = v
+                else:
+                    self._df = self._df[~hit].reset_index(drop=True)
+            self._rev += 1
+            return row['BookingID']
+
+    def write_many_if(self, expected_rev, rows):
+        with self._lock:
+            if self._rev != expected_rev: return None
+            rows = [dict(r, BookingID=r.get('BookingID') or new_booking_id()) for r in rows]
+            self._df = pd.concat([self._df, pd.DataFrame(rows)], ignore_index=True)
+            self._rev += 1
+            return [r['BookingID'] for r in rows]
+
+    def compact(self, df, expected_rev):
+        with self._lock:
+            if self._rev != expected_rev: return None
+            self._df = df.reset_index(drop=True)
+            self._rev += 1
+            return len(df)
+
+
+def import_backend(source, target):
+    """One-shot copy of bookings (hot and archived), stock, users and cars (e.g. CarBookingDB sheets -> SQLite)."""
+    df_book, archive = source.read_bookings(), source.read_archive()
+    target.compact(with_archive(archive, df_book), target.revision())
+    if not archive.empty:
+        # Re-split at the newest archived booking (older hot rows, if any, are archived too)
+        target.archive_bookings(archive['End_Time'].max() + pd.Timedelta(seconds=1))
+    target.save_stock(source.read_stock())
+    target.save_users(source.read_users())
+    target.save_cars(source.read_cars())
+    return len(df_book) + len(archive)
+
+
+def find_booking_conflicts(df_book, row, company_cars, stock_totals, book_idx=None, equip_table=None):
+    """Reasons `row` cannot be stored next to `df_book` (its own BookingID is ignored)."""
+    if book_idx is None: book_idx = BookingIndex.from_frame(df_book)
+    if equip_table is None: equip_table = build_equipment_table(df_book)
+    own = df_book.index[df_book['BookingID'] == row.get('BookingID')] if row.get('BookingID') else []
+    exclude = own[0] if len(own) else None
+    start, end = row['Start_Time'], row['End_Time']
+    reasons = []
+    if row['Car'] in company_cars and book_idx.overlapping(start, end, car=row['Car'], exclude=exclude):
+        reasons.append(f"รถ {row['Car']} ไม่ว่างช่วงนี้")
+    used = equipment_usage(equip_table, book_idx.overlapping(start, end, exclude=exclude))
+    for item, qty in parse_equip_str(row.get('Equipment', '-')).items():
+        if item in stock_totals and int(used.get(item, 0)) + qty > stock_totals[item]:
+            reasons.append(f"{item} เหลือไม่พอ (ว่าง {max(0, stock_totals[item] - int(used.get(item, 0)))})")
+    return reasons
+
+
+def commit_booking(store, op, row, company_cars, stock_totals, snapshot=None, book_idx=None, equip_table=None, retries=3):
+    """Validate against the latest stored bookings and write only if nobody committed in between.
+
+    op is 'add', 'edit' or 'cancel'. `snapshot` is the already loaded df_book (with its
+    revision in attrs, plus its index/equipment table if at hand) so the common
+    uncontended case needs no extra read. Raises
+    BookingConflict if the row no longer fits or the store stays contended.
+    """
+    for _ in range(retries + 1):
+        rev = store.revision()
+        if op != 'cancel':
+            if snapshot is not None and snapshot.attrs.get('revision') == rev:
+                latest = snapshot
+            else:
+                # Only the window can conflict; SQL backends answer this from their index
+                latest, book_idx, equip_table = store.read_bookings(row['Start_Time'], row['End_Time']), None, None
+            reasons = find_booking_conflicts(latest, row, company_cars, stock_totals, book_idx, equip_table)
+            if reasons: raise BookingConflict(reasons)
+        booking_id = store.write_if(rev, op, row)
+        if booking_id is not None: return booking_id
+        snapshot = None
+    raise BookingConflict(["มีการแก้ไขข้อมูลพร้อมกันหลายรายการ กรุณาลองใหม่"])
+
+
+def find_batch_conflicts(df_book, rows, company_cars, stock_totals, book_idx=None, equip_table=None):
+    """Reasons the new `rows` cannot all be stored next to `df_book` and next to each other."""
+    if book_idx is None: book_idx = BookingIndex.from_frame(df_book)
+    if equip_table is None: equip_table = build_equipment_table(df_book)
+    plan = TripPlan(book_idx, equip_table, stock_totals, company_cars)
+    reasons = []
+    for i, row in enumerate(rows):
+        equip = parse_equip_str(row.get('Equipment', '-'))
+        reasons += [f"รายการที่ {i + 1}: {r}" for r in plan.conflicts(row['Car'], equip, row['Start_Time'], row['End_Time'])]
+        plan.place(i, row['Car'], equip, row['Start_Time'], row['End_Time'])
+    return reasons
+
+
+def commit_bookings(store, rows, company_cars, stock_totals, snapshot=None, book_idx=None, equip_table=None, retries=3, check=None):
+    """Add all `rows` in a single write, or none of them; same revision protocol as commit_booking.
+
+    `check(latest, rows, book_idx, equip_table)` replaces find_batch_conflicts as the validation.
+    Returns the new booking ids. Raises BookingConflict listing every row that no longer fits.
+    """
+    rows = [dict(r, BookingID=r.get('BookingID') or new_booking_id()) for r in rows]
+    if not rows: return []
+    for _ in range(retries + 1):
+        rev = store.revision()
+        if snapshot is not None and snapshot.attrs.get('revision') == rev:
+            latest = snapshot
+        else:
+            start, end = min(r['Start_Time'] for r in rows), max(r['End_Time'] for r in rows)
+            latest, book_idx, equip_table = store.read_bookings(start, end), None, None
+        if check is not None:
+            reasons = check(latest, rows, book_idx, equip_table)
+        else:
+            reasons = find_batch_conflicts(latest, rows, company_cars, stock_totals, book_idx, equip_table)
+        if reasons: raise BookingConflict(reasons)
+        ids = store.write_many_if(rev, rows)
+        if ids is not None: return ids
+        snapshot = None
+    raise BookingConflict(["มีการแก้ไขข้อมูลพร้อมกันหลายรายการ กรุณาลองใหม่"])
@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from storage import BookingConflict, MemoryBackend, SQLiteBackend, apply_changes, commit_booking, commit_bookings
+
+CARS = {"Isuzu Mu-X", "Honda Jazz 2019"}
+STOCK = {"GPS": 2}
+
+
+def booking(car="Isuzu Mu-X", start=8, end=12, equipment="-", **extra):
+    return dict({"User": "Admin", "Task": "t", "Car": car, "People": 2, "Equipment": equipment, "Location": "L",
+                 "Start_Time": datetime(2030, 1, 1, start), "End_Time": datetime(2030, 1, 1, end)}, **extra)
+
+
+def snapshot(store):
+    rev = store.revision()
+    df = store.read_bookings()
+    df.attrs['revision'] = rev
+    return df
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return MemoryBackend() if request.param == "memory" else SQLiteBackend(str(tmp_path / "navgo.db"))
+
+
+def test_stale_snapshot_is_revalidated(store):
+    stale = snapshot(store)
+    commit_booking(store, 'add', booking(), CARS, STOCK)
+    with pytest.raises(BookingConflict):
+        commit_booking(store, 'add', booking(start=10, end=14), CARS, STOCK, snapshot=stale)
+    assert len(store.read_bookings()) == 1
+
+
+def test_stale_revision_is_not_written(store):
+    rev = store.revision()
+    commit_booking(store, 'add', booking(), CARS, STOCK)
+    assert store.write_if(rev, 'add', booking(car="Honda Jazz 2019")) is None
+    assert store.write_many_if(rev, [booking(car="Honda Jazz 2019")]) is None
+    assert store.compact(store.read_bookings(), rev) is None
+    assert len(store.read_bookings()) == 1
+
+
+def test_edit_ignores_its_own_row(store):
+    booking_id = commit_booking(store, 'add', booking(equipment="GPS x2"), CARS, STOCK)
+    moved = booking(start=10, end=14, equipment="GPS x2", BookingID=booking_id)
+    commit_booking(store, 'edit', moved, CARS, STOCK, snapshot=snapshot(store))
+    df = store.read_bookings()
+    assert len(df) == 1 and df['Start_Time'].iloc[0] == datetime(2030, 1, 1, 10)
+
+
+def test_edit_or_cancel_of_missing_booking_conflicts(store):
+    booking_id = commit_booking(store, 'add', booking(), CARS, STOCK)
+    commit_booking(store, 'cancel', {"BookingID": booking_id}, CARS, STOCK)
+    rev = store.revision()
+    with pytest.raises(BookingConflict):
+        commit_booking(store, 'edit', booking(BookingID=booking_id), CARS, STOCK)
+    with pytest.raises(BookingConflict):
+        commit_booking(store, 'cancel', {"BookingID": booking_id}, CARS, STOCK)
+    assert store.revision() == rev
+
+
+def test_batch_rows_conflict_with_each_other(store):
+    with pytest.raises(BookingConflict) as e:
+        commit_bookings(store, [booking(), booking(start=11, end=13)], CARS, STOCK)
+    assert len(e.value.reasons) == 1
+    with pytest.raises(BookingConflict):
+        commit_bookings(store, [booking(equipment="GPS x2"), booking(car="Honda Jazz 2019", equipment="GPS x1")], CARS, STOCK)
+    assert store.read_bookings().empty
+    ids = commit_bookings(store, [booking(), booking(start=12, end=16)], CARS, STOCK)
+    assert sorted(store.read_bookings()['BookingID']) == sorted(ids)
+
+
+def test_concurrent_adds_book_a_car_once(store):
+    results, barrier = [], threading.Barrier(8)
+
+    def add(i):
+        barrier.wait()
+        try:
+            results.append(commit_booking(store, 'add', booking(Task=f"t{i}"), CARS, STOCK, retries=10))
+        except BookingConflict:
+            results.append(None)
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert sum(r is not None for r in results) == 1
+    assert len(store.read_bookings()) == 1
+
+
+def test_first_commit_on_empty_store_keeps_time_dtypes(store):
+    empty = snapshot(store)
+    row = booking()
+    row['BookingID'] = commit_booking(store, 'add', row, CARS, STOCK, snapshot=empty)
+    df, dropped, _ = apply_changes(empty, [('add', row)])
+    assert dropped == [] and list(df['BookingID']) == [row['BookingID']]
+    assert df['Start_Time'].dt.strftime('%H:%M').tolist() == ['08:00']
+    assert df['End_Time'].dtype.kind == 'M'
+
+
+def test_applied_changes_match_storage(store):
+    ids = commit_bookings(store, [booking(), booking(car="Honda Jazz 2019")], CARS, STOCK)
+    before = snapshot(store)
+    edit = booking(start=13, end=15, BookingID=ids[0])
+    commit_booking(store, 'edit', edit, CARS, STOCK, snapshot=before)
+    after = snapshot(store)
+    commit_booking(store, 'cancel', {"BookingID": ids[1]}, CARS, STOCK, snapshot=after)
+    df, _, _ = apply_changes(before, [('edit', edit), ('cancel', {"BookingID": ids[1]})])
+    stored = store.read_bookings()
+    cols = ['BookingID', 'Car', 'Start_Time', 'End_Time']
+    assert df[cols].reset_index(drop=True).equals(stored[cols].reset_index(drop=True))
+    assert apply_changes(stored, [('cancel', {"BookingID": ids[1]})]) is None